@@ -0,0 +1,146 @@
+"""
+This script builds an embedding index of the arbitration document pages, so the later pipeline stages
+(`test_contr.py` and `results_processing.py`) can run similarity searches over the documents without embedding
+them again on every run.
+
+The script performs the following tasks:
+1. Loads the document pages from `combined_doc_sections_with_tables.json`.
+2. Embeds the page texts with Azure OpenAI's `text-embedding-3-small` model, in batches of 256.
+3. L2-normalizes the embeddings and saves them to `doc_index.npy`, along with `doc_index_meta.json` which holds
+   the section, page and a hash of the text of every row (in the same order as the pages in the JSON file).
+
+The other scripts load the index with `load_doc_index`, which memory-maps the array and returns None if the index
+is missing or no longer matches the document pages.
+
+Environment Variables:
+- AZURE_OPENAI_API_KEY: Azure API key for OpenAI.
+- AZURE_OPENAI_ENDPOINT: Azure OpenAI endpoint URL.
+
+Dependencies:
+- openai (Azure OpenAI via `openai.AzureOpenAI`)
+- numpy
+- orjson
+- os, hashlib
+"""
+
+import hashlib
+import os
+import numpy as np
+import orjson
+from openai import AzureOpenAI
+
+DOCS_PATH = "../results/combined_doc_sections_with_tables.json"
+INDEX_PATH = "../results/doc_index.npy"
+META_PATH = "../results/doc_index_meta.json"
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIMENSIONS = 1536
+
+# Texts are cut to stay under the embedding model's 8k token input limit
+MAX_EMBEDDING_CHARS = 20000
+
+
+def text_hash(text):
+    """Returns a short hash of a page text, used to check that the index matches the document pages."""
+    return hashlib.blake2b((text or "").encode("utf-8"), digest_size=8).hexdigest()
+
+
+def embed_texts(client, texts, batch_size=256):
+    """
+    Embeds texts with Azure OpenAI's embedding model.
+
+    Parameters:
+        client (AzureOpenAI): The Azure OpenAI client.
+        texts (list): List of strings to embed.
+        batch_size (int): Number of texts per embeddings request.
+
+    Returns:
+        np.ndarray: L2-normalized embeddings, one row per text (an empty (0, EMBEDDING_DIMENSIONS) array
+                    if there are no texts).
+    """
+    if not texts:
+        return np.empty((0, EMBEDDING_DIMENSIONS), dtype=np.float32)
+
+    texts = [(text or " ")[:MAX_EMBEDDING_CHARS] for text in texts]
+
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        response = client.embeddings.create(
+            model=EMBEDDING_MODEL, input=texts[start:start + batch_size])
+        vectors.extend(item.embedding for item in response.data)
+        print(f"Embedded {len(vectors)}/{len(texts)} texts.")
+
+    vectors = np.array(vectors, dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def build_doc_index(client, document_pages, batch_size=256):
+    """
+    Embeds the text of every document page.
+
+    Parameters:
+        client (AzureOpenAI): The Azure OpenAI client.
+        document_pages (list): List of dictionaries representing pages of the arbitration documents.
+        batch_size (int): Number of pages per embeddings request.
+
+    Returns:
+        tuple: The L2-normalized embeddings (np.ndarray, one row per page) and the metadata of every row.
+    """
+    vectors = embed_texts(
+        client, [entry.get("text") for entry in document_pages], batch_size)
+
+    meta = [
+        {"section": entry.get("section"), "page": entry.get("page"), "hash": text_hash(entry.get("text"))}
+        for entry in document_pages
+    ]
+
+    return vectors, meta
+
+
+def load_doc_index(document_pages, index_path=INDEX_PATH, meta_path=META_PATH):
+    """
+    Loads the document embedding index built by this script.
+
+    Parameters:
+        document_pages (list): The document pages the index is used with.
+        index_path (str): Path to the `.npy` embeddings.
+        meta_path (str): Path to the JSON metadata.
+
+    Returns:
+        np.ndarray or None: The memory-mapped embeddings (row i belongs to document_pages[i]), or None if the index
+                            doesn't exist or was built from different document pages.
+    """
+    if not (os.path.exists(index_path) and os.path.exists(meta_path)):
+        return None
+
+    with open(meta_path, "rb") as f:
+        meta = orjson.loads(f.read())
+
+    if len(meta) != len(document_pages) or any(
+            row["hash"] != text_hash(entry.get("text")) for row, entry in zip(meta, document_pages)):
+        print(f"{index_path} doesn't match the document pages, run build_doc_index.py to rebuild it.")
+        return None
+
+    return np.load(index_path, mmap_mode="r")
+
+
+if __name__ == "__main__":
+    client_openai = AzureOpenAI(
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        api_version="2024-10-21",
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
+    )
+
+    # Loading the document pages
+    with open(DOCS_PATH, "rb") as f:
+        document_pages = orjson.loads(f.read())
+
+    vectors, meta = build_doc_index(client_openai, document_pages)
+
+    # Saving the index
+    np.save(INDEX_PATH, vectors)
+    with open(META_PATH, "wb") as f:
+        f.write(orjson.dumps(meta, option=orjson.OPT_INDENT_2))
+
+    print(f"Document index with {len(meta)} pages saved to {INDEX_PATH}")
@@ -0,0 +1,146 @@
+"""
+This module provides a disk-backed cache for Azure OpenAI chat completion responses, so re-running a
+script with identical prompts doesn't send the same requests (and pay for them) again.
+
+Responses are stored in a SQLite database at `../.llm_cache/responses.sqlite`, keyed by a SHA-256 hash of
+all request parameters (model, messages, temperature, max_tokens, response_format, ...). Entries expire
+after `DEFAULT_TTL` seconds.
+
+Usage:
+    from cache import cached_chat
+
+    chat_completion = cached_chat(client_openai)
+    response = chat_completion(model="gpt-4o", messages=messages, temperature=0)
+
+The wrapper works with both `AzureOpenAI` and `AsyncAzureOpenAI` clients (for the latter it has to be awaited)
+and returns the same `ChatCompletion` objects as the client.
+
+Dependencies:
+- openai (for rebuilding `ChatCompletion` objects from cached responses)
+- sqlite3, hashlib, json, os, time, threading
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletion
+
+CACHE_PATH = "../.llm_cache/responses.sqlite"
+
+# Cached responses are kept for 30 days
+DEFAULT_TTL = 30 * 24 * 60 * 60
+
+
+def make_key(**request):
+    """
+    Computes the cache key of a request.
+
+    Parameters:
+        **request: The keyword arguments of the API call.
+
+    Returns:
+        str: SHA-256 hex digest of the request parameters serialized with sorted keys.
+    """
+    payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    A minimal SQLite key/value store with per-entry expiry.
+
+    Parameters:
+        path (str): Path to the SQLite database file (created if missing).
+        ttl (int): Number of seconds a stored value stays valid.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=DEFAULT_TTL):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        """Returns the stored value for `key`, or None if it's missing or expired."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+
+        if row is None or row[1] < time.time():
+            return None
+
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        """Stores a JSON-serializable value under `key`."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time() + self.ttl)
+            )
+            self._conn.commit()
+
+    def delete(self, key):
+        """Removes the value stored under `key`, if any."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+
+
+_default_cache = None
+
+
+def get_default_cache():
+    """Returns the shared cache at `CACHE_PATH`, opening it on first use."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResponseCache()
+    return _default_cache
+
+
+def cached_chat(client, cache=None):
+    """
+    Wraps `client.chat.completions.create` with the response cache.
+
+    Parameters:
+        client: An `AzureOpenAI` or `AsyncAzureOpenAI` client.
+        cache (ResponseCache, optional): The cache to use, defaults to the shared one.
+
+    Returns:
+        callable: A function taking the same keyword arguments as `client.chat.completions.create`.
+                  It is a coroutine function if `client` is asynchronous.
+    """
+    cache = cache or get_default_cache()
+    create = client.chat.completions.create
+
+    if isinstance(client, AsyncOpenAI):
+        async def cached_create(**request):
+            key = make_key(**request)
+            cached = cache.get(key)
+            if cached is not None:
+                return ChatCompletion.model_validate(cached)
+
+            response = await create(**request)
+            cache.set(key, response.model_dump(mode="json"))
+            return response
+    else:
+        def cached_create(**request):
+            key = make_key(**request)
+            cached = cache.get(key)
+            if cached is not None:
+                return ChatCompletion.model_validate(cached)
+
+            response = create(**request)
+            cache.set(key, response.model_dump(mode="json"))
+            return response
+
+    return cached_create
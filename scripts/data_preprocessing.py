@@ -7,16 +7,44 @@ shared as a standalone file. This script replicates that practice for easier doc
 
 The sections are defined in a dictionary where each key is a section name and each value is the 1-indexed starting page 
 of that section in the original PDF. The resulting PDFs are saved to the specified output folder with filenames indicating 
-their order and section name.
+their order and section name. Sections are written in parallel worker processes, each opening its own copy 
+of the input PDF.
 
 Dependencies:
 - PyMuPDF (imported as `fitz`)
 - os module for file operations
+- itertools (`pairwise`, Python 3.10+)
+- concurrent.futures for parallel section writing
 
 """
 
 import fitz
 import os
+from itertools import pairwise
+from concurrent.futures import ProcessPoolExecutor
+
+
+def _write_section(args):
+    """
+    Writes pages [start, end) of the input PDF to a new PDF file.
+
+    Runs in a worker process, so it opens its own document instead of receiving a `fitz` object
+    (which can't be pickled).
+
+    Parameters:
+    -----------
+    args : tuple
+        (input_path, start, end, output_path) with 0-indexed `start` and exclusive `end`.
+    """
+    input_path, start, end, output_path = args
+
+    doc = fitz.open(input_path)
+    subdoc = fitz.open()
+    # Links aren't needed for OCR, so their resolution is skipped
+    subdoc.insert_pdf(doc, from_page=start, to_page=end - 1, links=False)
+    subdoc.save(output_path, garbage=4, deflate=True)
+    subdoc.close()
+    doc.close()
 
 
 def split_pdf_by_sections(input_path, output_folder, sections):
@@ -34,36 +62,32 @@ def split_pdf_by_sections(input_path, output_folder, sections):
         for each section in the input PDF.
 
     The function creates individual PDF files for each section and saves them in the output folder 
-    with filenames prefixed by their order.
+    with filenames prefixed by their order. The sections are written in parallel using a process pool.
     """
-    # Opening the original PDF
-    doc = fitz.open(input_path)
+    # Getting the page count of the original PDF
+    with fitz.open(input_path) as doc:
+        page_count = len(doc)
 
     # Ensuring output folder exists
     os.makedirs(output_folder, exist_ok=True)
 
-    # Converting section dictionary to a list for ordered processing
-    section_items = list(sections.items())
+    # Converting section dictionary to a list for ordered processing,
+    # the sentinel marks the end of the last section
+    section_items = list(sections.items()) + [(None, page_count + 1)]
 
-    for i in range(len(section_items)):
-        title, start_page = section_items[i]
+    section_args = []
+    for i, ((title, start_page), (_, next_start_page)) in enumerate(pairwise(section_items)):
         start = start_page - 1
-
-        # Determining end page
-        if i < len(section_items) - 1:
-            end = section_items[i + 1][1] - 1
-        else:
-            end = len(doc)
-
-        # Extracting and saving section
-        subdoc = fitz.open()
-        subdoc.insert_pdf(doc, from_page=start, to_page=end - 1)
+        end = next_start_page - 1
 
         filename = f"{i+1:02d} - {title}.pdf"
-        subdoc.save(os.path.join(output_folder, filename))
-        subdoc.close()
+        section_args.append(
+            (input_path, start, end, os.path.join(output_folder, filename)))
+
+    # Extracting and saving sections in parallel
+    with ProcessPoolExecutor(max_workers=min(8, len(section_args))) as executor:
+        list(executor.map(_write_section, section_args))
 
-    doc.close()
     print("PDF successfully split.")
 
 
@@ -101,8 +125,10 @@ sections = {
     "Procedural Order No. 2": 54
 }
 
-split_pdf_by_sections(
-    input_path,
-    output_folder,
-    sections=sections
-)
+# Guarding the entry point, since worker processes re-import this module
+if __name__ == "__main__":
+    split_pdf_by_sections(
+        input_path,
+        output_folder,
+        sections=sections
+    )
@@ -14,14 +14,19 @@ Input:
 
 Output:
 - Updated JSON file with extracted table paragraphs: combined_doc_sections_with_tables.json
+- While running, each finished PDF is appended to combined_doc_sections_with_tables.jsonl so an interrupted
+  run resumes where it stopped; the file is removed once the output is saved.
 
 Dependencies:
 - os
-- json
+- json, orjson
 - pathlib
-- re
+- asyncio
+- tenacity
 - google (Gemini via `google.genai`)
-- openai (Azure OpenAI via `openai.AzureOpenAI`)
+- openai (Azure OpenAI via `openai.AsyncAzureOpenAI`)
+- json_stream (local module, reads the JSONL progress file)
+- gemini_tables (local module, parses the tables extracted by Gemini)
 
 
 """
@@ -29,144 +34,275 @@ Dependencies:
 import os
 import json
 import pathlib
-import re
+import asyncio
+import orjson
 from google import genai
-from google.genai import types
-from openai import AzureOpenAI
-
-
-def extract_tables_and_add_paragraphs(pdf_path, existing_json):
+from google.genai import errors, types
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+from openai import AsyncAzureOpenAI
+from json_stream import load_progress
+from gemini_tables import MalformedTablesError, parse_tables_json
+
+# Setting up Google GenAI and Azure OpenAI clients once so their connections are reused across PDFs
+client_genai = genai.Client(
+    vertexai=True,
+    project=os.getenv("PROJECT_ID"),
+    location=os.getenv("LOCATION_GEMINI")
+)
+
+client_openai = AsyncAzureOpenAI(
+    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+    api_version="2024-10-21",
+    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
+)
+
+# Structured output schema for the table paragraphs, one paragraph per table id
+_PARAGRAPHS_SCHEMA = {
+    "name": "table_paragraphs",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "paragraphs": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "integer"},
+                        "text": {"type": "string"}
+                    },
+                    "required": ["id", "text"],
+                    "additionalProperties": False
+                }
+            }
+        },
+        "required": ["paragraphs"],
+        "additionalProperties": False
+    }
+}
+
+
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=1, max=10),
+    retry=retry_if_exception_type((errors.APIError, MalformedTablesError)),
+    reraise=True
+)
+async def extract_tables_with_gemini(pdf_bytes):
     """
-    Extracts tables from a given PDF file using Gemini 2.5 Flash, then converts each table into a descriptive 
-    paragraph using GPT-4o (Azure OpenAI), and appends the results to an existing JSON structure.
+    Extracts the tables from a PDF using Gemini 2.5 Flash in JSON mode, so the response can be parsed
+    directly. The call is retried with exponential backoff on API errors, malformed JSON and JSON that
+    isn't a list of page entries.
 
     Parameters:
     -----------
-    pdf_path : pathlib.Path
-        Path to the PDF file to be processed.
-
-    existing_json : list
-        A list of dictionaries containing previously extracted content.
+    pdf_bytes : bytes
+        Content of the PDF file.
 
     Returns:
     --------
     list
-        The updated list with newly added table-based descriptive paragraphs.
+        A list of {"page": ..., "tables": ...} dictionaries, one per page with tables.
     """
-
-    section_name = pdf_path.stem.split(" - ", 1)[-1].strip()
-
-    client_genai = genai.Client(
-        vertexai=True,
-        project=os.getenv("PROJECT_ID"),
-        location=os.getenv("LOCATION_GEMINI")
-    )
-
-    # Reading the PDF
-    pdf_file = pathlib.Path(pdf_path)
-    response = client_genai.models.generate_content(
+    response = await client_genai.aio.models.generate_content(
         model="gemini-2.5-flash-preview-04-17",
         contents=[
-            """Extract only the tables from the attached PDF and return the result in **valid JSON format**.
+            """Extract only the tables from the attached PDF and return the result as a JSON array.
 
-            Group all tables by their page number. For each entry in the json, use the following structure:
+            Group all tables by their page number. For each entry in the array, use the following structure:
 
             {
               "page": <page_number>,
               "tables": ...
             }
 
-            If you see any subcategories or subheaders include those.
-            Do not include any text or commentary outside the JSON structure. Only return JSON.""",
-            types.Part.from_bytes(data=pdf_file.read_bytes(),
+            If you see any subcategories or subheaders include those.""",
+            types.Part.from_bytes(data=pdf_bytes,
                                   mime_type="application/pdf"),
         ],
+        config=types.GenerateContentConfig(
+            response_mime_type="application/json"),
     )
+    return parse_tables_json(response.text)
 
-    # Extracting JSON block from the GenAI response
-    def extract_json_code_block(text):
-        """
-        Extracts and parses a JSON code block from a string that contains a markdown-style JSON block (OpenAI's response).
-
-        Parameters:
-        -----------
-        text : str
-            The string containing the JSON code block.
-
-        Returns:
-        --------
-        list or None
-            A list of dictionaries parsed from the JSON block, or None if parsing fails.
-        """
-        match = re.search(r"```json\s*(\[\s*{.*?}\s*])\s*```", text, re.DOTALL)
-        if match:
-            try:
-                parsed = json.loads(match.group(1))
-                return parsed
-            except json.JSONDecodeError:
-                print("Failed to parse JSON from extracted block.")
-        return None
-
-    tables = extract_json_code_block(response.text)
+
+async def extract_tables_and_add_paragraphs(pdf_path, semaphore, tables_per_call=10):
+    """
+    Extracts tables from a given PDF file using Gemini 2.5 Flash, then converts each table into a descriptive 
+    paragraph using GPT-4o (Azure OpenAI). The tables are sent `tables_per_call` at a time, concurrently; a group
+    whose response is cut off, refused or unparseable is retried as two smaller groups.
+
+    Parameters:
+    -----------
+    pdf_path : pathlib.Path
+        Path to the PDF file to be processed.
+
+    semaphore : asyncio.Semaphore
+        Limits the number of API requests in flight to respect rate limits.
+
+    tables_per_call : int
+        Number of tables converted in one GPT-4o request.
+
+    Returns:
+    --------
+    list
+        The newly extracted table-based descriptive paragraphs for this PDF.
+    """
+
+    section_name = pdf_path.stem.split(" - ", 1)[-1].strip()
+
+    # Reading the PDF inside the semaphore so only a bounded number of PDF buffers are alive at once
+    pdf_file = pathlib.Path(pdf_path)
+    async with semaphore:
+        pdf_bytes = await asyncio.to_thread(pdf_file.read_bytes)
+        tables = await extract_tables_with_gemini(pdf_bytes)
+        del pdf_bytes
 
     # If nothing extracted or no non-empty tables, skip
     if not tables or all(not page.get("tables") for page in tables):
         print(f"No tables found in {pdf_path.name}, skipping.")
-        return existing_json
+        return []
 
-    # Setting up Azure OpenAI client
-    client_openai = AzureOpenAI(
-        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-        api_version="2024-02-01",
-        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-    )
+    # Numbering the tables so each paragraph can be matched back to its table
+    numbered_tables = {
+        table_id: table for table_id, table in enumerate(tables, start=1)}
 
-    # Processing tables into paragraphs
-    for table in tables:
+    async def summarize_tables(table_ids):
+        """Returns the paragraphs of the given tables, splitting the group in half if the response is unusable"""
         prompt = f"""
-You are given a list of extracted tables from a document. Each entry includes the table data and the page number.
+You are given a list of extracted tables from a document. Each entry includes an id, the table data and the page number.
 
-Analyze the table and convert the data into a descriptive paragraph that is clear and understandable and contains all the data provided in the table, ensuring to include all the row, column, subrow, and subcolumn names in the paragraph. Don't include the page number.
+For each entry, analyze the table and convert the data into a descriptive paragraph that is clear and understandable and contains all the data provided in the table, ensuring to include all the row, column, subrow, and subcolumn names in the paragraph. Don't include the page number.
+Return exactly one paragraph per entry together with the entry's id.
 
 Here is the input data:
-{json.dumps([table], indent=2)}
+{json.dumps([{"id": table_id, **numbered_tables[table_id]} for table_id in table_ids], indent=2)}
 """
 
-        response = client_openai.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that turns tables into structured paragraphs."},
-                {"role": "user", "content": prompt},
-            ]
-        )
-
-        generated_paragraph = response.choices[0].message.content.strip()
-
-        # Storing the results in the existing JSON
-        existing_json.append({
+        async with semaphore:
+            response = await client_openai.chat.completions.create(
+                model="gpt-4o",
+                messages=[
+                    {"role": "system", "content": "You are a helpful assistant that turns tables into structured paragraphs."},
+                    {"role": "user", "content": prompt},
+                ],
+                response_format={"type": "json_schema",
+                                 "json_schema": _PARAGRAPHS_SCHEMA}
+            )
+
+        choice = response.choices[0]
+        try:
+            if choice.message.refusal:
+                raise ValueError(f"Refused: {choice.message.refusal}")
+            if choice.finish_reason == "length":
+                raise ValueError("Response cut off by the token limit.")
+            return json.loads(choice.message.content)["paragraphs"]
+        except (ValueError, KeyError, TypeError) as e:
+            if len(table_ids) == 1:
+                print(f"No usable paragraph for table {table_ids[0]} in {pdf_path.name}: {e}")
+                return []
+
+            print(f"Retrying tables {table_ids} of {pdf_path.name} in smaller groups: {e}")
+            half = len(table_ids) // 2
+            first, second = await asyncio.gather(
+                summarize_tables(table_ids[:half]), summarize_tables(table_ids[half:]))
+            return first + second
+
+    table_ids = list(numbered_tables)
+    group_results = await asyncio.gather(
+        *(summarize_tables(table_ids[start:start + tables_per_call])
+          for start in range(0, len(table_ids), tables_per_call)))
+    paragraphs = [paragraph for result in group_results for paragraph in result]
+
+    # Storing the results in table order
+    table_paragraphs = []
+    for paragraph in sorted(paragraphs, key=lambda p: p["id"]):
+        table = numbered_tables.get(paragraph["id"])
+        if table is None:
+            print(
+                f"Unknown table id {paragraph['id']} in {pdf_path.name}, skipping.")
+            continue
+
+        table_paragraphs.append({
             "page": table["page"],
             "section": section_name,
-            "text": generated_paragraph,
+            "text": paragraph["text"].strip(),
             "type": "table"
         })
 
+    # Reporting the tables the model didn't write a paragraph for
+    missing_ids = sorted(set(numbered_tables) - {paragraph["id"] for paragraph in paragraphs})
+    if missing_ids:
+        print(
+            f"No paragraph returned for tables {missing_ids} (pages "
+            f"{[numbered_tables[table_id]['page'] for table_id in missing_ids]}) in {pdf_path.name}.")
+
+    return table_paragraphs
+
+
+async def add_tables_to_json(pdf_folder, existing_json, progress_path):
+    """
+    Runs the table extraction for all PDF files in a folder concurrently and appends the results
+    to the existing JSON structure in folder order.
+
+    Each finished PDF is appended to a JSONL progress file as soon as it completes; PDFs already
+    present in that file (from an interrupted run) are not processed again.
+
+    Parameters:
+    -----------
+    pdf_folder : pathlib.Path
+        Folder containing the PDF files.
+
+    existing_json : list
+        A list of dictionaries containing previously extracted content.
+
+    progress_path : str
+        Path to the JSONL progress file.
+
+    Returns:
+    --------
+    list
+        The updated list with newly added table-based descriptive paragraphs.
+    """
+    semaphore = asyncio.Semaphore(8)
+    pdf_paths = sorted(pdf_folder.glob("*.pdf"))
+    done = load_progress(progress_path)
+
+    with open(progress_path, "ab") as progress_file:
+        async def process_pdf(pdf_path):
+            paragraphs = await extract_tables_and_add_paragraphs(pdf_path, semaphore)
+            progress_file.write(orjson.dumps(
+                {"file": pdf_path.name, "records": paragraphs}) + b"\n")
+            progress_file.flush()
+
+        await asyncio.gather(
+            *(process_pdf(pdf_path) for pdf_path in pdf_paths if pdf_path.name not in done))
+
+    # Merging the per-PDF results once all tasks are done to avoid races on existing_json
+    done = load_progress(progress_path)
+    for pdf_path in pdf_paths:
+        existing_json.extend(done[pdf_path.name])
+
     return existing_json
 
 
 # Loading existing JSON
-with open("../results/combined_doc_sections.json", "r", encoding="utf-8") as f:
-    existing_json = json.load(f)
+with open("../results/combined_doc_sections.json", "rb") as f:
+    existing_json = orjson.loads(f.read())
 
 # Defining path to the PDF files
 pdf_folder = pathlib.Path("../data/32nd-Vis-Moot_Problem_incl_PO2")
 
-# Looping through all PDF files in the folder
-for pdf_file in pdf_folder.glob("*.pdf"):
-    updated_json = extract_tables_and_add_paragraphs(pdf_file, existing_json)
+# Processing all PDF files in the folder
+progress_path = "../results/combined_doc_sections_with_tables.jsonl"
+updated_json = asyncio.run(add_tables_to_json(
+    pdf_folder, existing_json, progress_path))
 
 # Saving the updated JSON to a new file
 output_path = "../results/combined_doc_sections_with_tables.json"
-with open(output_path, "w", encoding="utf-8") as f:
-    json.dump(updated_json, f, indent=4, ensure_ascii=False)
+with open(output_path, "wb") as f:
+    f.write(orjson.dumps(updated_json, option=orjson.OPT_INDENT_2))
+
+os.remove(progress_path)
 
 print("Table extraction and updates complete!")
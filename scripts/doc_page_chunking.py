@@ -12,20 +12,26 @@ The Document AI processor is configured via environment variables:
 - PROCESSOR_ID
 - LOCATION
 
-Each PDF is passed to Document AI, which performs OCR and returns structured text. The results 
-are saved in `../results/combined_doc_sections.json` .
+Each PDF is passed to Document AI, which performs OCR and returns structured text. The PDFs are sent 
+concurrently through the async Document AI client (at most 4 requests in flight). Each finished PDF 
+is appended to `../results/combined_doc_sections.jsonl`, so an interrupted run resumes where it stopped. 
+The results are saved in `../results/combined_doc_sections.json` and the progress file is removed.
 
 Dependencies:
 - Google Cloud Document AI Python SDK
-- os, json, re
+- os, pathlib, asyncio
+- orjson
+- json_stream (local module, reads the JSONL progress file)
 
 """
 
 import os
-import json
-import re
+import pathlib
+import asyncio
+import orjson
 from google.api_core.client_options import ClientOptions
 from google.cloud import documentai_v1
+from json_stream import load_progress
 
 os.makedirs("../results", exist_ok=True)
 
@@ -34,38 +40,37 @@ project_id = os.getenv("PROJECT_ID")
 processor_id = os.getenv("PROCESSOR_ID")
 location = os.getenv("LOCATION")
 
-# Initializing Document AI client
+# Document AI client options (the async client is created inside the event loop)
 opts = ClientOptions(api_endpoint=f"{location}-documentai.googleapis.com")
-client_doc_ai = documentai_v1.DocumentProcessorServiceClient(
-    client_options=opts)
-full_processor_name = client_doc_ai.processor_path(
+full_processor_name = documentai_v1.DocumentProcessorServiceAsyncClient.processor_path(
     project_id, location, processor_id)
 
 
-def extract_text_per_page(pdf_path, section_name):
+async def extract_text_per_page(client_doc_ai, pdf_path, section_name, semaphore):
     """Processes a PDF using Document AI OCR and returns a list of {page, section, text} dictionaries"""
-    with open(pdf_path, "rb") as f:
-        image_content = f.read()
-
-    raw_document = documentai_v1.RawDocument(
-        content=image_content,
-        mime_type="application/pdf",
-    )
-
-    request = documentai_v1.ProcessRequest(
-        name=full_processor_name, raw_document=raw_document)
-    result = client_doc_ai.process_document(request=request)
+    async with semaphore:
+        # Reading the file in a worker thread so the event loop isn't blocked
+        image_content = await asyncio.to_thread(pathlib.Path(pdf_path).read_bytes)
+
+        raw_document = documentai_v1.RawDocument(
+            content=image_content,
+            mime_type="application/pdf",
+        )
+
+        request = documentai_v1.ProcessRequest(
+            name=full_processor_name, raw_document=raw_document)
+        result = await client_doc_ai.process_document(request=request)
     document = result.document
 
     text = document.text
     page_texts = []
 
     for i, page in enumerate(document.pages):
-        page_text = ""
-        for segment in page.layout.text_anchor.text_segments:
-            start = int(segment.start_index) if segment.start_index else 0
-            end = int(segment.end_index)
-            page_text += text[start:end]
+        # Joining the page's text segments in one pass instead of repeated string concatenation
+        page_text = "".join(
+            text[int(segment.start_index or 0):int(segment.end_index)]
+            for segment in page.layout.text_anchor.text_segments
+        )
 
         page_texts.append({
             "page": i + 1,
@@ -76,25 +81,56 @@ def extract_text_per_page(pdf_path, section_name):
     return page_texts
 
 
+async def process_pdfs(tasks, progress_file):
+    """Runs OCR on all (filename, pdf_path, section) tasks concurrently, appending each PDF's pages to the progress file"""
+    client_doc_ai = documentai_v1.DocumentProcessorServiceAsyncClient(
+        client_options=opts)
+    semaphore = asyncio.Semaphore(4)
+
+    async def extract_text_per_page_wrapper(task):
+        filename, pdf_path, section = task
+        print(f"Processing: {filename}")
+        section_pages = await extract_text_per_page(client_doc_ai, pdf_path, section, semaphore)
+
+        progress_file.write(orjson.dumps(
+            {"file": filename, "records": section_pages}) + b"\n")
+        progress_file.flush()
+
+    await asyncio.gather(*(extract_text_per_page_wrapper(task) for task in tasks))
+
+
 # Folder containing split PDFs
 pdf_folder = "../data/32nd-Vis-Moot_Problem_incl_PO2"
 combined_data = []
 
-# Processing each PDF in the folder
+# Collecting each PDF in the folder
+tasks = []
 for filename in sorted(os.listdir(pdf_folder)):
     if filename.endswith(".pdf"):
-        section_match = re.match(r"\d+\s*-\s*(.+)\.pdf", filename)
-        section = section_match.group(
-            1) if section_match else filename.replace(".pdf", "")
+        # Filenames follow the "NN - <section>.pdf" format produced by data_preprocessing.py
+        name = filename[:-4]
+        section = name.split(" - ", 1)[1] if " - " in name else name
         pdf_path = os.path.join(pdf_folder, filename)
+        tasks.append((filename, pdf_path, section))
 
-        print(f"Processing: {filename}")
-        section_pages = extract_text_per_page(pdf_path, section)
-        combined_data.extend(section_pages)
+# Processing the PDFs concurrently, skipping the ones saved by a previous interrupted run
+progress_path = "../results/combined_doc_sections.jsonl"
+done = load_progress(progress_path)
+pending_tasks = [task for task in tasks if task[0] not in done]
+
+with open(progress_path, "ab") as progress_file:
+    asyncio.run(process_pdfs(pending_tasks, progress_file))
+
+# Combining the pages in folder order
+done = load_progress(progress_path)
+for filename, _, _ in tasks:
+    combined_data.extend(done[filename])
 
 # Saving to JSON
 output_path = "../results/combined_doc_sections.json"
-with open(output_path, "w", encoding="utf-8") as f:
-    json.dump(combined_data, f, indent=4, ensure_ascii=False)
+with open(output_path, "wb") as f:
+    f.write(orjson.dumps(combined_data, option=orjson.OPT_INDENT_2))
+
+os.remove(progress_path)
 
 print(f"All PDFs processed and combined into '{output_path}'")
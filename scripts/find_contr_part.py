@@ -2,9 +2,9 @@
 This script processes a list of contradiction entries and evaluates the most relevant chunks of 
 text from associated legal documents to identify the likely cause of each contradiction.
 
-It uses Azure OpenAI's GPT-4o model to:
-- Score relevance of text chunks to the contradiction.
-- Complete incomplete sentences if the most relevant chunk is cut off at the beginning or end.
+It uses Azure OpenAI to:
+- Score relevance of text chunks to the contradiction via cosine similarity of text-embedding-3-small embeddings.
+- Complete incomplete sentences with GPT-4o if the most relevant chunk is cut off at the beginning or end.
 
 The main function `evaluate_contradiction_sources` adds the most relevant chunk and a relevance 
 score to each contradiction entry.
@@ -15,16 +15,26 @@ Environment Variables:
 
 Dependencies:
 - os
-- json
 - re
+- string
+- functools
+- concurrent.futures
+- orjson
+- numpy
 - openai (Azure OpenAI via openai.AzureOpenAI)
+- build_doc_index (local module, embedding model settings)
 
 """
 
-import json
 import os
 import re
+import string
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import orjson
 from openai import AzureOpenAI
+from build_doc_index import EMBEDDING_MODEL, MAX_EMBEDDING_CHARS
 
 
 client_openai = AzureOpenAI(
@@ -33,14 +43,27 @@ client_openai = AzureOpenAI(
     azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
 )
 
+# Leading characters of a line that continue the previous line or start a new paragraph
+_CONTINUATION_LEADS = frozenset(string.ascii_lowercase + string.digits)
+_PARAGRAPH_LEADS = frozenset(string.ascii_uppercase + "•(")
+
+# Well-formed chunk boundaries: capital, digit, quote, parenthesis, bracket, bullet or dash at the start,
+# and sentence-ending punctuation, quote, colon or semicolon at the end
+_CHUNK_START_RE = re.compile(r'^[A-Z0-9"\'“‘(\[•\-]')
+_CHUNK_END_RE = re.compile(r'[.!?:;"\'”’]\s*$')
+
+# Chunks shorter than this are likely OCR artifacts and aren't worth a completion call
+MIN_COMPLETION_LENGTH = 40
+
 
 def break_into_chunks(text):
     """
     Breaks a block of text into smaller, semantically meaningful chunks (paragraphs).
 
-    It:
+    It walks the lines once and classifies each line by its first character:
         - Merges lines that are likely mid-sentence (i.e., when a line starts with a lowercase letter or digit).
-        - Keeps paragraph breaks when a line starts with a capital letter, bullet, or number.
+        - Starts a new paragraph when a line starts with a capital letter, bullet, or parenthesis, or is empty.
+        - Keeps any other line in the current paragraph on its own line.
 
     Args:
         text (str): Raw document text with newline characters.
@@ -48,12 +71,96 @@ def break_into_chunks(text):
     Returns:
         list of str: Cleaned and separated paragraphs from the original text.
     """
-    text = re.sub(r'\n(?=[a-z0-9])', ' ', text)
-    text = re.sub(r'\n(?=[A-Z•\(])', '\n\n', text)
-    paragraphs = [p.strip() for p in re.split(r'\n{2,}', text) if p.strip()]
+    paragraphs = []
+    current = []
+
+    for line in text.split("\n"):
+        lead = line[:1]
+        if lead in _CONTINUATION_LEADS:
+            if current:
+                current.append(" ")
+            current.append(line)
+        elif lead in _PARAGRAPH_LEADS or not line:
+            paragraph = "".join(current).strip()
+            if paragraph:
+                paragraphs.append(paragraph)
+            current = [line]
+        else:
+            if current:
+                current.append("\n")
+            current.append(line)
+
+    paragraph = "".join(current).strip()
+    if paragraph:
+        paragraphs.append(paragraph)
+
     return paragraphs
 
 
+def needs_completion(chunk):
+    """
+    Checks whether a chunk is clearly cut off mid-sentence and should be completed by the model.
+
+    Args:
+        chunk (str): The most relevant chunk of a contradiction.
+
+    Returns:
+        bool: True if the chunk is long enough and doesn't start or end at a natural boundary.
+    """
+    if len(chunk) < MIN_COMPLETION_LENGTH:
+        return False
+
+    return not _CHUNK_START_RE.match(chunk) or not _CHUNK_END_RE.search(chunk)
+
+
+@functools.lru_cache(maxsize=256)
+def break_into_chunks_cached(text):
+    """
+    Memoized version of `break_into_chunks`, so contradictions that share the same document page
+    are only chunked once.
+
+    Args:
+        text (str): Raw document text with newline characters.
+
+    Returns:
+        tuple of str: Cleaned and separated paragraphs from the original text.
+    """
+    return tuple(break_into_chunks(text))
+
+
+# Embeddings keyed by text, shared across contradictions so repeated chunks are only embedded once
+_embedding_cache = {}
+
+
+def embed_texts(texts):
+    """
+    Embeds a list of texts with Azure OpenAI's embedding model (`EMBEDDING_MODEL`), cutting each text to
+    `MAX_EMBEDDING_CHARS` characters.
+
+    Only texts that haven't been embedded before are sent to the API (in a single request);
+    the rest are served from `_embedding_cache`.
+
+    Args:
+        texts (list of str): Texts to embed.
+
+    Returns:
+        numpy.ndarray: L2-normalized embeddings, one row per text.
+    """
+    missing = list(dict.fromkeys(
+        text for text in texts if text not in _embedding_cache))
+
+    if missing:
+        response = client_openai.embeddings.create(
+            model=EMBEDDING_MODEL,
+            input=[(text or " ")[:MAX_EMBEDDING_CHARS] for text in missing]
+        )
+        for text, item in zip(missing, response.data):
+            vector = np.array(item.embedding, dtype=np.float32)
+            _embedding_cache[text] = vector / np.linalg.norm(vector)
+
+    return np.stack([_embedding_cache[text] for text in texts])
+
+
 def evaluate_contradiction_sources(contradictions, full_docs):
     """
     Identifies the most likely cause of contradictions by scoring chunks of associated document text
@@ -63,24 +170,32 @@ def evaluate_contradiction_sources(contradictions, full_docs):
 
     For each eligible contradiction entry:
         - Breaks the document text into smaller chunks.
-        - Uses a language model to score each chunk's relevance to the contradiction (scale: 1–10).
-        - Identifies the most relevant chunk based on the highest score.
-        - If the selected chunk ends mid-sentence, requests the model to complete it using the full document context,
-          ensuring the chunk ends at a natural sentence boundary.
+        - Embeds the contradiction and all chunks in one request and scores each chunk by cosine similarity.
+        - Identifies the most relevant chunk based on the highest similarity.
+        - If the selected chunk is clearly cut off mid-sentence (see `needs_completion`), requests the model to complete
+          it using the full document context, ensuring the chunk ends at a natural sentence boundary.
 
     Args:
         contradictions (list of dict): Each dictionary may include:
             - 'result' (str): The contradiction explanation text.
             - 'doc_text' (str): The full document text (not from tables).
             - 'doc_type' (str, optional): Present if the contradiction originates from a table.
+        full_docs (list of dict): All document pages with 'section', 'page' and 'text', used to look up
+            the previous and next page of a contradiction's page.
 
     Returns:
         list of dict: Updated entries with two new keys:
             - 'most_relevant_chunk' (str or None): The chunk most likely causing the contradiction.
-            - 'relevance_score' (int): The chunk’s relevance score (1–10). If skipped, set to 0.
+            - 'relevance_score' (int): The chunk’s cosine similarity scaled to 0–10. If skipped, set to 0.
     """
     results = []
 
+    # Indexing page texts by (section, page) for neighbouring page lookups,
+    # the first entry wins so text pages take precedence over table paragraphs
+    page_idx = {}
+    for doc in full_docs:
+        page_idx.setdefault((doc.get("section"), doc.get("page")), doc.get("text", ""))
+
     for i, entry in enumerate(contradictions):
         if "doc_type" in entry:
             print(
@@ -91,51 +206,28 @@ def evaluate_contradiction_sources(contradictions, full_docs):
         contradiction_text = entry["result"]
         doc_text = entry["doc_text"]
 
-        chunks = break_into_chunks(doc_text)
+        chunks = break_into_chunks_cached(doc_text)
         best_score = -1
         best_chunk = ""
 
-        for chunk in chunks:
-            prompt = f"""Here is a contradiction:
-
-{contradiction_text}
-
-Evaluate the following chunk from a legal document to determine how likely it caused this contradiction.
-Return only a number from 1 to 10 (1 = not relevant, 10 = directly caused it).
-
-Chunk:
-{chunk}"""
-
+        if chunks:
             try:
-                response = client_openai.chat.completions.create(
-                    model="gpt-4o",
-                    messages=[
-                        {"role": "system", "content": "You are a legal analyst evaluating legal contradictions."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.2
-                )
-                score_text = response.choices[0].message.content.strip()
-                score = int(re.search(r"\d+", score_text).group())
-
-                if score > best_score:
-                    best_score = score
-                    best_chunk = chunk
+                vectors = embed_texts([contradiction_text, *chunks])
+                scores = vectors[1:] @ vectors[0]
+                best_index = int(scores.argmax())
+                best_score = round(float(scores[best_index]) * 10)
+                best_chunk = chunks[best_index]
 
             except Exception as e:
                 print(f"Error at entry {i}: {e}")
-                continue
-        prev_page = ""
-        next_page = ""
-        for doc in full_docs:
-            if doc.get("section") == entry.get("doc_section") and doc.get("page") == entry.get("doc_page") - 1:
-                prev_page = doc.get("text", "")
-            if doc.get("section") == entry.get("doc_section") and doc.get("page") == entry.get("doc_page") + 1:
-                next_page = doc.get("text", "")
-            if prev_page and next_page:
-                break
+
         # Checking if the most relevant chunk seems like an incomplete sentence and completing using GPT-4o
-        if best_chunk and (not best_chunk.endswith(('.', '!', '?')) or not best_chunk[0].isupper()):
+        if best_chunk and needs_completion(best_chunk):
+            doc_section = entry.get("doc_section")
+            doc_page = entry.get("doc_page")
+            prev_page = page_idx.get((doc_section, doc_page - 1), "")
+            next_page = page_idx.get((doc_section, doc_page + 1), "")
+
             completion_prompt = f"""If the following chunk seems to have an unfinished sentence, or lacks context:
 
 {best_chunk}
@@ -178,33 +270,35 @@ Return only the completed text chunk."""
     return results
 
 
-# Finding most relevant chunk for the meaningful contradictions
+def load_json(path):
+    """Reads and parses a JSON file with orjson."""
+    with open(path, 'rb') as f:
+        return orjson.loads(f.read())
+
+
+# Loading the contradictions and the full documents concurrently
 contr_path = '../results/correct_contradictions.json'
+contr_path_flagged = '../results/flagged_contradictions.json'
 full_docs_path = '../results/combined_doc_sections_with_tables.json'
 
-with open(contr_path, 'r', encoding='utf-8') as f:
-    contradictions = json.load(f)
+with ThreadPoolExecutor(max_workers=3) as executor:
+    contradictions, contradictions_flagged, full_docs = executor.map(
+        load_json, [contr_path, contr_path_flagged, full_docs_path])
 
-with open(full_docs_path, 'r', encoding='utf-8') as f:
-    full_docs = json.load(f)
 
+# Finding most relevant chunk for the meaningful contradictions
 results_contr_chunks = evaluate_contradiction_sources(
     contradictions, full_docs)
 
 # Saving in a JSON
-with open("../results/final_correct_contr.json", "w", encoding="utf-8") as f:
-    json.dump(results_contr_chunks, f, ensure_ascii=False, indent=4)
+with open("../results/final_correct_contr.json", "wb") as f:
+    f.write(orjson.dumps(results_contr_chunks, option=orjson.OPT_INDENT_2))
 
 
 # Finding most relevant chunk for all contradictions
-contr_path_flagged = '../results/flagged_contradictions.json'
-
-with open(contr_path_flagged, 'r', encoding='utf-8') as f:
-    contradictions_flagged = json.load(f)
-
 results_contr_chunks_flagged = evaluate_contradiction_sources(
     contradictions_flagged, full_docs)
 
 # Saving in a JSON
-with open("../results/final_flagged_contr.json", "w", encoding="utf-8") as f:
-    json.dump(results_contr_chunks_flagged, f, ensure_ascii=False, indent=4)
+with open("../results/final_flagged_contr.json", "wb") as f:
+    f.write(orjson.dumps(results_contr_chunks_flagged, option=orjson.OPT_INDENT_2))
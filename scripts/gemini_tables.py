@@ -0,0 +1,50 @@
+"""
+This module parses the tables Gemini extracts from a PDF, shared by `doc_adding_tables.py` and `w_s_chunking.py`.
+
+Gemini is asked for a JSON array of {"page": ..., "tables": ...} entries, but JSON mode only guarantees valid JSON,
+not the shape of it. `parse_tables_json` accepts the common deviations (a single page entry, or an object wrapping
+the list) and raises `MalformedTablesError` for anything else, so the callers can retry the request.
+
+Usage:
+    from gemini_tables import MalformedTablesError, parse_tables_json
+
+    tables = parse_tables_json(response.text)
+
+Dependencies:
+- orjson
+"""
+
+import orjson
+
+
+class MalformedTablesError(ValueError):
+    """Raised when Gemini's JSON isn't a list of {"page": ..., "tables": ...} entries."""
+
+
+def parse_tables_json(text):
+    """
+    Parses Gemini's table extraction response.
+
+    Parameters:
+        text (str): The JSON response returned by Gemini.
+
+    Returns:
+        list: A list of {"page": ..., "tables": ...} dictionaries.
+
+    Raises:
+        MalformedTablesError: If the response isn't valid JSON or isn't a list of page entries.
+    """
+    try:
+        tables = orjson.loads(text or "")
+    except orjson.JSONDecodeError as e:
+        raise MalformedTablesError(f"Invalid table JSON from Gemini: {(text or '')[:200]}") from e
+
+    # Accepting an object root, either a single page entry or a wrapper around the list of entries
+    if isinstance(tables, dict):
+        lists = [value for value in tables.values() if isinstance(value, list)]
+        tables = lists[0] if "page" not in tables and len(lists) == 1 else [tables]
+
+    if not isinstance(tables, list) or not all(isinstance(page, dict) and "page" in page for page in tables):
+        raise MalformedTablesError(f"Unexpected table JSON from Gemini: {text[:200]}")
+
+    return tables
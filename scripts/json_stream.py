@@ -0,0 +1,101 @@
+"""
+This module provides a small writer for producing large JSON arrays incrementally, so results are written out
+as soon as they're ready instead of being buffered in a list and dumped at the end.
+
+Usage:
+    from json_stream import JsonArrayWriter
+
+    with JsonArrayWriter("../results/output.json") as writer:
+        for entry in entries:
+            writer.write(entry)
+
+The output is a regular JSON array (each element indented with `orjson.OPT_INDENT_2`), readable with `json.load`.
+
+It also reads back the JSONL progress/checkpoint files the scripts append to while running (`read_jsonl`,
+`load_progress`), tolerating the partial last line an interrupted run leaves behind.
+
+Dependencies:
+- orjson
+- os
+"""
+
+import os
+import orjson
+
+
+class JsonArrayWriter:
+    """
+    Writes a JSON array to a file one element at a time.
+
+    Parameters:
+        path (str): Path to the output JSON file.
+        option (int): orjson options used to serialize each element.
+    """
+
+    def __init__(self, path, option=orjson.OPT_INDENT_2):
+        self._file = open(path, "wb")
+        self._option = option
+        self.count = 0
+        self._file.write(b"[\n")
+
+    def write(self, item):
+        """Appends one element to the array."""
+        if self.count:
+            self._file.write(b",\n")
+        self._file.write(orjson.dumps(item, option=self._option))
+        self.count += 1
+
+    def close(self):
+        """Closes the array and the file."""
+        if not self._file.closed:
+            self._file.write(b"\n]\n")
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_jsonl(path):
+    """
+    Reads the records of a JSONL file, skipping lines that can't be parsed.
+
+    A partial last line (from a run interrupted mid-write) is cut off the file, so records appended
+    afterwards start on a line of their own.
+
+    Parameters:
+        path (str): Path to the JSONL file.
+
+    Returns:
+        list: The parsed records, in file order (empty if the file doesn't exist).
+    """
+    if not os.path.exists(path):
+        return []
+
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if data and not data.endswith(b"\n"):
+        end = data.rfind(b"\n") + 1
+        print(f"Dropping a partial last line from {path}.")
+        with open(path, "r+b") as f:
+            f.truncate(end)
+        data = data[:end]
+
+    records = []
+    for line in data.splitlines():
+        if not line.strip():
+            continue
+        try:
+            records.append(orjson.loads(line))
+        except orjson.JSONDecodeError:
+            print(f"Skipping an unreadable line in {path}.")
+
+    return records
+
+
+def load_progress(progress_path):
+    """Returns {filename: records} for the PDFs already saved in the JSONL progress file"""
+    return {line["file"]: line["records"] for line in read_jsonl(progress_path)}
@@ -11,9 +11,11 @@ The main functions in this script are:
 2. `add_titles_to_entries`: Adds section titles to contradiction entries based on a dictionary of titles for document sections
    and witness sections.
    
-3. `check_contradictions_with_context`: For each contradiction, this function divides the full documents into chunks, extracts
-   the most relevant context related to the contradiction from these chunks using a language model, and evaluates the contradiction's
-   validity with respect to the context. It adds a 'contr_correct' field indicating whether the contradiction is valid ('yes' or 'no').
+3. `check_contradictions_with_context`: For each contradiction, this function retrieves the document pages most similar to
+   the contradiction entry from the document embedding index (built by `build_doc_index.py`), and evaluates the contradiction's
+   validity with respect to that context. It adds a 'contr_correct' field indicating whether the contradiction is valid ('yes' or 'no').
+   With `--llm-extraction`, the context is instead extracted by a language model from 3 chunks of the full documents (the chunks
+   are sent concurrently).
 
 4. `filter_correct_contr`: Filters the contradictions that have been validated ('yes' in `contr_correct` field).
 
@@ -31,7 +33,8 @@ Parameters and outputs:
     - Output: Updated list of contradiction entries with added section titles.
   
 - `check_contradictions_with_context`: 
-    - Inputs: `contradictions` (list of contradiction entries), `full_docs_path` (path to the full documents).
+    - Inputs: `contradictions` (list of contradiction entries), `full_docs_path` (path to the full documents)
+      or `full_docs` (the already parsed documents).
     - Output: List of contradiction entries with context evaluation (`contr_correct` field).
   
 - `filter_correct_contr`: 
@@ -46,29 +49,82 @@ Dependencies:
 - `os`: Standard Python library for interacting with the operating system (used for loading environment variables).
 - `json`: Standard Python library for parsing and working with JSON data.
 - `re`: Standard Python library for regular expressions (used for extracting titles from section identifiers).
+- `difflib`: Standard Python library used to pre-screen duplicate contradiction descriptions by text similarity.
+- `asyncio`: Standard Python library used to send the per-chunk context extraction requests concurrently.
+- `argparse`: Standard Python library used for the `--llm-extraction` command line flag.
+- `numpy`: Used to score the document pages against the contradiction embeddings.
+- `orjson`: Fast JSON library used to read the inputs and write the results.
 - `openai`: The OpenAI Python client library for interacting with the Azure OpenAI API (used to access GPT models).
+- `cache`: Local module caching the model responses on disk, so re-runs don't repeat identical requests.
+- `json_stream`: Local module writing the checked contradictions to JSON one entry at a time.
+- `build_doc_index`: Local module with the document embedding index.
 
 """
 
 import os
 import json
 import re
-from openai import AzureOpenAI
-
-
-# Setting up the Azure OpenAI client
+import difflib
+import asyncio
+import argparse
+import numpy as np
+import orjson
+from openai import AsyncAzureOpenAI, AzureOpenAI
+from cache import cached_chat
+from json_stream import JsonArrayWriter
+from build_doc_index import build_doc_index, embed_texts, load_doc_index
+
+
+# Setting up the Azure OpenAI clients
 client_openai = AzureOpenAI(
     api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    api_version="2024-02-01",
+    api_version="2024-10-21",
     azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
 )
 
+client_openai_async = AsyncAzureOpenAI(
+    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+    api_version="2024-10-21",
+    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
+)
+
+# Chat completions served from the response cache when the same request was already made
+chat_completion = cached_chat(client_openai)
+chat_completion_async = cached_chat(client_openai_async)
+
+# Matching the exhibit name in parentheses in a witness section, e.g. "Witness Statement (Claimant Exhibit C 5)"
+_PAREN_RE = re.compile(r'\(([^)]+)\)')
+
+UNKNOWN_SECTION = "Unknown Section"
+UNKNOWN_WITNESS_SECTION = "Unknown Witness Section"
+
+# Constraining the yes/no answers of the model to {"verdict": "yes" | "no"}
+_VERDICT_SCHEMA = {
+    "name": "verdict",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "verdict": {"type": "string", "enum": ["yes", "no"]}
+        },
+        "required": ["verdict"],
+        "additionalProperties": False
+    }
+}
+
+
+def parse_verdict(response):
+    """Returns the 'yes' or 'no' verdict of a structured output response."""
+    return json.loads(response.choices[0].message.content)["verdict"]
+
 
 def merge_unique_contradictions(file1_path, file2_path):
     """
     Merges contradiction entries from two JSON files, filtering out duplicates based on section, page, and 
-    witness statement. If entries match on these keys but have different contradiction descriptions, it uses
-    a language model to decide if they are describing the same contradiction.
+    witness statement. The entries of the first file are indexed by these keys, so each entry of the second file
+    is only compared to the entries sharing its keys. If they match but have different contradiction descriptions,
+    clearly different (similarity below 0.3) or near-identical (above 0.95) descriptions are settled by text
+    similarity, and a language model decides if the rest are describing the same contradiction.
 
     Args:
         file1_path (str): Path to the first JSON file.
@@ -79,52 +135,74 @@ def merge_unique_contradictions(file1_path, file2_path):
     """
     def filter_contradictions(data):
         """Returns only entries where 'result' includes a contradiction."""
-        return [entry for entry in data if 'result' in entry and 'Contradiction:' in entry['result']]
+        return [entry for entry in data if 'Contradiction:' in (entry.get('result') or '')]
+
+    def reference_key(entry):
+        """Returns the (section, page, witness statement) key of an entry."""
+        return entry.get("doc_section"), entry.get("doc_page"), entry.get("witness_statement")
+
+    def is_duplicate(entry1, entry2):
+        """Checks if two entries with the same reference describe the same contradiction."""
+        result1, result2 = entry1['result'], entry2['result']
+        if result1 == result2:
+            return True
+
+        # Settling clearly different or near-identical descriptions without the model
+        # (quick_ratio is a cheap upper bound of ratio)
+        matcher = difflib.SequenceMatcher(None, result1, result2)
+        similarity = matcher.quick_ratio()
+        if similarity < 0.3:
+            return False
+        if similarity > 0.95 and matcher.ratio() > 0.95:
+            return True
+
+        messages = [
+            {"role": "system", "content": "You are a legal expert helping identify duplicate contradictions."},
+            {"role": "user", "content": (
+                f"Here are two contradiction descriptions from the same section, page, and witness:\n\n"
+                f"Contradiction 1:\n{result1}\n\n"
+                f"Contradiction 2:\n{result2}\n\n"
+                "Are these describing the same contradiction? Reply only with 'yes' or 'no'."
+            )}
+        ]
 
-    with open(file1_path, 'r', encoding='utf-8') as f1:
-        data1 = filter_contradictions(json.load(f1))
+        response = chat_completion(
+            model="o3-mini",
+            messages=messages,
+            temperature=0,
+            response_format={"type": "json_schema",
+                             "json_schema": _VERDICT_SCHEMA}
+        )
+
+        return parse_verdict(response) == "yes"
+
+    with open(file1_path, 'rb') as f1:
+        data1 = filter_contradictions(orjson.loads(f1.read()))
+
+    with open(file2_path, 'rb') as f2:
+        data2 = filter_contradictions(orjson.loads(f2.read()))
 
-    with open(file2_path, 'r', encoding='utf-8') as f2:
-        data2 = filter_contradictions(json.load(f2))
+    # Indexing the entries by (section, page, witness statement)
+    index = {}
+    for entry1 in data1:
+        index.setdefault(reference_key(entry1), []).append(entry1)
 
     for entry2 in data2:
-        match_found = False
-        for entry1 in data1:
-            same_reference = (
-                entry1.get("doc_section") == entry2.get("doc_section") and
-                entry1.get("doc_page") == entry2.get("doc_page") and
-                entry1.get("witness_statement") == entry2.get(
-                    "witness_statement")
-            )
+        candidates = index.setdefault(reference_key(entry2), [])
 
-            if same_reference:
-                messages = [
-                    {"role": "system", "content": "You are a legal expert helping identify duplicate contradictions."},
-                    {"role": "user", "content": (
-                        f"Here are two contradiction descriptions from the same section, page, and witness:\n\n"
-                        f"Contradiction 1:\n{entry1['result']}\n\n"
-                        f"Contradiction 2:\n{entry2['result']}\n\n"
-                        "Are these describing the same contradiction? Reply only with 'yes' or 'no'."
-                    )}
-                ]
-
-                response = client_openai.chat.completions.create(
-                    model="o3-mini",
-                    messages=messages,
-                    temperature=0
-                )
-
-                answer = response.choices[0].message.content.strip().lower()
-                if "yes" in answer:
-                    match_found = True
-                    break
-
-        if not match_found:
+        if not any(is_duplicate(entry1, entry2) for entry1 in candidates):
             data1.append(entry2)
+            candidates.append(entry2)
 
     return data1
 
 
+# Reading the command line options
+parser = argparse.ArgumentParser(description="Merges and validates the detected contradictions.")
+parser.add_argument("--llm-extraction", action="store_true",
+                    help="Extract the context with GPT-4.1 instead of retrieving it from the document embedding index")
+args = parser.parse_args()
+
 file1_path = "../results/comp_results1.json"
 file2_path = "../results/comp_results2.json"
 
@@ -147,23 +225,34 @@ def add_titles_to_entries(merged_data, titles):
     Returns:
         list: The merged data with titles added for doc_section and witness_section.
     """
+    get_title = titles.get
+    search_paren = _PAREN_RE.search
+
+    # Resolving each distinct witness section once; entries share a handful of sections
+    witness_titles = {}
+
     for entry in merged_data:
         # Getting the section from the entry
         section_d = entry.get("doc_section")
         section_w = entry.get("witness_section")
 
         # Addding general title from doc_section
-        entry["doc_title"] = titles.get(section_d, "Unknown Section")
+        entry["doc_title"] = get_title(section_d, UNKNOWN_SECTION)
 
         # Extracting title from section_w using the part in parentheses
         if section_w:
-            match = re.search(r'\(([^)]+)\)', section_w)
-            if match:
-                key_in_titles = match.group(1)  # e.g., "Claimant Exhibit C 5"
-                entry["witness_title"] = titles.get(
-                    key_in_titles, "Unknown Witness Section")
-            else:
-                entry["witness_title"] = "Unknown Witness Section"
+            witness_title = witness_titles.get(section_w)
+            if witness_title is None:
+                match = search_paren(section_w)
+                if match:
+                    key_in_titles = match.group(1)  # e.g., "Claimant Exhibit C 5"
+                    witness_title = get_title(
+                        key_in_titles, UNKNOWN_WITNESS_SECTION)
+                else:
+                    witness_title = UNKNOWN_WITNESS_SECTION
+                witness_titles[section_w] = witness_title
+
+            entry["witness_title"] = witness_title
 
     return merged_data
 
@@ -201,83 +290,116 @@ titles = {
 updated_data = add_titles_to_entries(merged_data, titles)
 
 
-def check_contradictions_with_context(contradictions, full_docs_path):
+async def check_contradictions_with_context(contradictions, full_docs_path=None, output_path=None,
+                                            llm_extraction=False, top_k=8, full_docs=None):
     """
     For each contradiction:
-    - GPT-4.1 scans 3 chunks of documents and finds relevant info.
-    - If no relevant info is found across all chunks, skip the contradiction.
+    - Retrieve the `top_k` document pages closest to the contradiction entry in embedding space.
+      With `llm_extraction`, GPT-4.1 instead scans 3 chunks of documents concurrently and finds relevant info.
+    - If no relevant info is found, skip the contradiction.
     - Otherwise, ask o3-mini if the contradiction makes sense in context.
     - Add 'contr_correct': 'yes' or 'no' to each valid contradiction.
+    If `output_path` is given, each checked contradiction is written to a temporary file next to it as soon as it's
+    done, which replaces `output_path` once every contradiction is checked.
+    The documents are read from `full_docs_path` unless they're passed already parsed as `full_docs`.
     """
-    with open(full_docs_path, 'r', encoding='utf-8') as f:
-        full_docs = json.load(f)
-
-    # Split into 3 parts
-    n = len(full_docs)
-    chunk_size = n // 3
-    doc_chunks = [
-        full_docs[i * chunk_size: (i + 1) *
-                  chunk_size] if i < 2 else full_docs[i * chunk_size:]
-        for i in range(3)
-    ]
+    if full_docs is None:
+        with open(full_docs_path, 'rb') as f:
+            full_docs = orjson.loads(f.read())
+
+    def format_doc(doc):
+        return f"[{doc.get('section', '')} - p.{doc.get('page', '')}]\n{doc.get('text', '')}"
+
+    entry_texts = [json.dumps(entry, indent=4, ensure_ascii=False) for entry in contradictions]
+
+    if llm_extraction:
+        # Split into 3 parts
+        n = len(full_docs)
+        chunk_size = n // 3
+        doc_chunks = [
+            full_docs[i * chunk_size: (i + 1) *
+                      chunk_size] if i < 2 else full_docs[i * chunk_size:]
+            for i in range(3)
+        ]
 
-    updated_contradictions = []
+        # Building the chunk texts once; they're sent first in every extraction prompt so the shared
+        # prefix is served from the prompt cache across contradiction entries
+        chunk_texts = [
+            "\n\n".join(format_doc(doc) for doc in chunk)
+            for chunk in doc_chunks
+        ]
+    else:
+        # Embedding the contradiction entries, and the document pages if the index wasn't built
+        doc_vectors = load_doc_index(full_docs)
+        if doc_vectors is None:
+            doc_vectors, _ = await asyncio.to_thread(build_doc_index, client_openai, full_docs)
 
-    for idx, entry in enumerate(contradictions):
-        entry_text = json.dumps(entry, indent=4, ensure_ascii=False)
-        relevant_context_parts = []
+        entry_vectors = await asyncio.to_thread(embed_texts, client_openai, entry_texts)
+        top_k = min(top_k, len(full_docs))
 
-        for i, chunk in enumerate(doc_chunks):
-            chunk_text = "\n\n".join(
-                f"[{doc.get('section', '')} - p.{doc.get('page', '')}]\n{doc.get('text', '')}"
-                for doc in chunk
-            )
+    async def extract_relevant(i, chunk_text, entry_text):
+        messages = [
+            {
+                "role": "system",
+                "content": "You are a legal assistant. Your job is to extract only the most relevant passages from the documents based on a contradiction entry."
+            },
+            {
+                "role": "user",
+                "content": f"""
+Here is a chunk of arbitration documents:
+{chunk_text}
 
-            messages = [
-                {
-                    "role": "system",
-                    "content": "You are a legal assistant. Your job is to extract only the most relevant passages from the documents based on a contradiction entry."
-                },
-                {
-                    "role": "user",
-                    "content": f"""
 Here is a contradiction entry:
 {entry_text}
 
-Here is a chunk of arbitration documents:
-{chunk_text}
-
 Please extract the most relevant text segments related to this contradiction (not limited to the witness statement and the exhibit that caused it). If there's nothing relevant, just skip. Don't include explanation, only text segments."
 """
-                }
-            ]
+            }
+        ]
 
-            response = client_openai.chat.completions.create(
-                model="gpt-4.1",
-                messages=messages,
-                temperature=0
-            )
+        response = await chat_completion_async(
+            model="gpt-4.1",
+            messages=messages,
+            temperature=0
+        )
 
-            relevant = response.choices[0].message.content.strip()
-            print(relevant)
-            relevant_context_parts.append(
-                f"--- From Chunk {i+1} ---\n{relevant}")
+        relevant = response.choices[0].message.content.strip()
+        print(relevant)
+        return f"--- From Chunk {i+1} ---\n{relevant}"
 
-        if not relevant_context_parts:
-            print(
-                f"Skipped {idx + 1}/{len(contradictions)} — no relevant context.")
-            continue
+    updated_contradictions = []
 
-        final_context = "\n\n".join(relevant_context_parts)
+    # Writing to a temporary file, so a failed run leaves the previous output in place
+    tmp_path = f"{output_path}.tmp" if output_path else None
+    writer = JsonArrayWriter(tmp_path) if output_path else None
 
-        decision_messages = [
-            {
-                "role": "system",
-                "content": "You are a legal expert assessing contradictions in arbitration documents."
-            },
-            {
-                "role": "user",
-                "content": f"""
+    try:
+        for idx, (entry, entry_text) in enumerate(zip(contradictions, entry_texts)):
+            if llm_extraction:
+                relevant_context_parts = await asyncio.gather(
+                    *(extract_relevant(i, chunk_text, entry_text) for i, chunk_text in enumerate(chunk_texts)))
+            else:
+                # Taking the most similar pages, best match first
+                scores = doc_vectors @ entry_vectors[idx]
+                top_pages = np.argpartition(-scores, top_k - 1)[:top_k] if top_k else []
+                relevant_context_parts = [format_doc(full_docs[page])
+                                          for page in sorted(top_pages, key=lambda page: -scores[page])]
+
+            if not relevant_context_parts:
+                print(
+                    f"Skipped {idx + 1}/{len(contradictions)} — no relevant context.")
+                continue
+
+            final_context = "\n\n".join(relevant_context_parts)
+
+            decision_messages = [
+                {
+                    "role": "system",
+                    "content": "You are a legal expert assessing contradictions in arbitration documents."
+                },
+                {
+                    "role": "user",
+                    "content": f"""
 Here is the contradiction entry:
 {entry_text}
 
@@ -291,20 +413,30 @@ Ignore harmless or explainable changes (e.g., a change in CEO, company name, or
 Only mark 'yes' if the contradiction is substantial and would actually help a lawyer identify a misrepresentation or inconsistency worth pursuing.
 Reply only with 'yes' or 'no'."
 """
-            }
-        ]
+                }
+            ]
 
-        decision = client_openai.chat.completions.create(
-            model="o3-mini",
-            messages=decision_messages,
-            temperature=0
-        )
+            decision = await chat_completion_async(
+                model="o3-mini",
+                messages=decision_messages,
+                temperature=0,
+                response_format={"type": "json_schema",
+                                 "json_schema": _VERDICT_SCHEMA}
+            )
+
+            entry["contr_correct"] = parse_verdict(decision)
+            updated_contradictions.append(entry)
+            if writer:
+                writer.write(entry)
 
-        entry["contr_correct"] = decision.choices[0].message.content.strip().lower()
-        updated_contradictions.append(entry)
+            print(
+                f"Processed {idx + 1}/{len(contradictions)}: contr_correct = {entry['contr_correct']}")
+    finally:
+        if writer:
+            writer.close()
 
-        print(
-            f"Processed {idx + 1}/{len(contradictions)}: contr_correct = {entry['contr_correct']}")
+    if writer:
+        os.replace(tmp_path, output_path)
 
     return updated_contradictions
 
@@ -313,22 +445,25 @@ def filter_correct_contr(entries):
     """
     Returns only entries where contr_correct is 'yes'.
     """
-    return [entry for entry in entries if "yes" in entry.get("contr_correct", "").strip().lower()]
+    return [entry for entry in entries if entry.get("contr_correct") == "yes"]
+
 
+# Loading the full documents once
+with open("../results/combined_doc_sections_with_tables.json", 'rb') as f:
+    full_docs = orjson.loads(f.read())
 
 # Checking the contradictions with context
-checked = check_contradictions_with_context(
+# (the results are saved to flagged_contradictions.json as they come in)
+checked = asyncio.run(check_contradictions_with_context(
     merged_data,
-    full_docs_path="../results/combined_doc_sections_with_tables.json"
-)
-
-# Saving the results
-with open("../results/flagged_contradictions.json", "w", encoding="utf-8") as f:
-    json.dump(checked, f, indent=4, ensure_ascii=False)
+    full_docs=full_docs,
+    output_path="../results/flagged_contradictions.json",
+    llm_extraction=args.llm_extraction
+))
 
 # Keeping meaningful contradictions
 correct_contr = filter_correct_contr(checked)
 
 # Saving the results
-with open("../results/correct_contradictions.json", 'w', encoding='utf-8') as f:
-    json.dump(correct_contr, f, indent=4, ensure_ascii=False)
+with open("../results/correct_contradictions.json", 'wb') as f:
+    f.write(orjson.dumps(correct_contr, option=orjson.OPT_INDENT_2))
@@ -4,9 +4,18 @@ inconsistencies, or conflicts. The comparison is performed using OpenAI's Azure
 witness statement is checked against a section of an arbitration document.
 
 The script performs the following tasks:
-1. Loads and filters the relevant arbitration document pages and witness statements.
+1. Loads and filters the relevant arbitration document pages and witness statements, then embeds them
+   (`text-embedding-3-small`) and keeps only the `top_k` most similar document pages for each witness statement.
+   The document embeddings are read from the index built by `build_doc_index.py` when it's available.
 2. Uses OpenAI's API to check for contradictions between the witness statement and the arbitration document.
-3. Stores the results of the comparison, including any identified contradictions, in a JSON file.
+   The checks are sent concurrently (bounded by a semaphore) and retried with backoff on rate limits and server errors,
+   or, when `use_batch_api` is set, submitted as a single job to the Azure OpenAI Batch API.
+   Identical (witness text, document text) pairs are only checked once, and the witness statements compared to the
+   same page are packed into one request that returns a JSON verdict per statement.
+   Responses of the concurrent checks are cached on disk (see `cache.py`), so re-runs only pay for new pairs.
+3. Stores the results of the comparison, including any identified contradictions, in a JSON file, writing the
+   entries out one at a time. Checked pairs are also appended to a JSONL checkpoint as they complete, so an
+   interrupted run can be restarted without repeating them.
 
 The results are saved in a file named `comp_results13.json`, which contains the following information for each comparison:
 - The witness statement text and its page and section.
@@ -19,145 +28,524 @@ Environment Variables:
 - AZURE_OPENAI_ENDPOINT: Azure OpenAI endpoint URL.
 
 Dependencies:
-- openai (Azure OpenAI via `openai.AzureOpenAI`)
-- os, json
+- openai (Azure OpenAI via `openai.AsyncAzureOpenAI`)
+- tenacity
+- numpy
+- orjson
+- cache (local module, SQLite response cache)
+- json_stream (local module, incremental JSON array writer)
+- build_doc_index (local module, document embedding index)
+- os, json, asyncio, hashlib
 """
 
+import hashlib
 import json
 import os
-from openai import AzureOpenAI
+import asyncio
+import numpy as np
+import orjson
+from openai import APIConnectionError, AsyncAzureOpenAI, InternalServerError, RateLimitError
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+from cache import cached_chat, get_default_cache, make_key
+from json_stream import JsonArrayWriter, read_jsonl
+from build_doc_index import EMBEDDING_MODEL, MAX_EMBEDDING_CHARS, load_doc_index
 
 # Load Azure OpenAI client
-client = AzureOpenAI(
+client = AsyncAzureOpenAI(
     api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    api_version="2024-02-01",
+    api_version="2024-10-21",
     azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
 )
 
+# Chat completions served from the response cache when the same request was already made
+chat_completion = cached_chat(client)
+
+# Token budget per witness sentence for its JSON verdict and ~20 word explanation (with headroom for longer
+# explanations), plus the JSON wrapper
+MAX_TOKENS_PER_SENTENCE = 100
+MAX_TOKENS_OVERHEAD = 20
+
+# Structured output schema of a contradiction check, one verdict per numbered sentence
+_RESULTS_SCHEMA = {
+    "name": "contradiction_results",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "results": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "integer"},
+                        "verdict": {"type": "string", "enum": ["Contradiction", "Neutral"]},
+                        "explanation": {"type": "string"}
+                    },
+                    "required": ["id", "verdict", "explanation"],
+                    "additionalProperties": False
+                }
+            }
+        },
+        "required": ["results"],
+        "additionalProperties": False
+    }
+}
+
+RESPONSE_FORMAT = {"type": "json_schema", "json_schema": _RESULTS_SCHEMA}
+
+
+class IncompleteResponseError(Exception):
+    """Raised when a response is truncated, can't be parsed or doesn't answer every sentence."""
+
 
-def check_contradiction(sentence, arbitration_document):
+# Static instructions, sent once as the system message of every request
+SYSTEM_PROMPT = """
+You are an expert in arbitration law and practice. Your task is to compare each of the numbered sentences you are given with a page from an arbitration document (e.g., an exhibit) and identify any contradictions, inconsistencies, or conflicts. A contradiction occurs when a sentence directly opposes the findings, legal reasoning, or rulings stated in the arbitration document.
+
+Please follow these steps for each sentence separately:
+1. Read the sentence and the full page carefully.
+2. Identify the key legal claims, defenses, arguments, and rulings in both the sentence and the page from the arbitration document.
+3. Compare these claims and arguments, and determine if the sentence contradicts any key facts, findings, or conclusions in the arbitration document.
+4. If a contradiction exists, set "verdict" to "Contradiction" and explain why the sentence contradicts the arbitration document in a clear and concise manner (about 20 words) in "explanation". If there is no contradiction, set "verdict" to "Neutral" and explain why there's no contradiction.
+5. Do not assume differences between earlier proposals and later outcomes happened because both parties agreed to a change unless the document states so.
+
+Respond with a JSON object of the form {"results": [{"id": <sentence number>, "verdict": "Contradiction" or "Neutral", "explanation": "..."}]}, with exactly one entry per sentence.
+"""
+
+
+def build_messages(sentences, arbitration_document):
     """
-    Compares a sentence (typically from a witness statement) against a page from an arbitration document 
-    to detect any contradictions or inconsistencies using Azure OpenAI's GPT-4o model.
+    Builds the chat messages comparing a group of sentences against a page from an arbitration document.
 
     Parameters:
-        sentence (str): The sentence from a witness statement to evaluate.
+        sentences (list): The sentences from witness statements to evaluate.
         arbitration_document (str): The full page of the arbitration document to compare against.
 
     Returns:
-        str: A result message indicating whether there is a contradiction ("Contradiction:") or not ("Neutral:"),
-             followed by a concise explanation.
+        list: The `messages` payload for a chat completion request.
     """
 
-    prompt = f"""
-You are an expert in arbitration law and practice. Your task is to compare the following sentence with a page from an arbitration document (e.g., an exhibit) and identify any contradictions, inconsistencies, or conflicts. A contradiction occurs when the sentence directly opposes the findings, legal reasoning, or rulings stated in the arbitration document.
+    numbered_sentences = "\n".join(
+        f"{idx}. \"{sentence}\"" for idx, sentence in enumerate(sentences, start=1))
 
-Please follow these steps:
-1. Read both the sentence and the full page carefully.
-2. Identify the key legal claims, defenses, arguments, and rulings in both the sentence and the page from the arbitration document.
-3. Compare these claims and arguments, and determine if the sentence contradicts any key facts, findings, or conclusions in the arbitration document.
-4. If a contradiction exists, start your response with the word "Contradiction:" and explain why the sentence contradicts the arbitration document in a clear and concise manner (about 20 words). If there is no contradiction, start your response with "Neutral:" and explain why there's no contradiction.
-5. Do not assume differences between earlier proposals and later outcomes happened because both parties agreed to a change unless the document states so.
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user",
+            "content": f"Page from an Arbitration Document:\n\"{arbitration_document}\"\n\nSentences:\n{numbered_sentences}"}
+    ]
 
-Sentence:
-\"{sentence}\"
 
-Page from an Arbitration Document:
-\"{arbitration_document}\"
-"""
+def max_tokens_for(sentences):
+    """Returns the completion token budget of a request checking `sentences`."""
+    return MAX_TOKENS_OVERHEAD + MAX_TOKENS_PER_SENTENCE * len(sentences)
+
+
+def parse_results(content, count, finish_reason=None):
+    """
+    Parses the model's JSON answer into one result message per sentence.
+
+    Parameters:
+        content (str): The JSON response returned by the model.
+        count (int): Number of sentences that were sent.
+        finish_reason (str, optional): The finish reason of the completion.
 
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system",
-                "content": "You are an expert in arbitration law and practice."},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=100
+    Returns:
+        list: Messages of the form "Contradiction: ..." or "Neutral: ...", in sentence order.
+
+    Raises:
+        IncompleteResponseError: If the response was cut off by the token limit, isn't valid JSON, or
+                                 doesn't have a verdict for every sentence.
+    """
+    if finish_reason == "length":
+        raise IncompleteResponseError(f"Response cut off by the token limit: {(content or '')[-200:]}")
+
+    try:
+        items = json.loads(content)["results"]
+    except (json.JSONDecodeError, KeyError, TypeError) as e:
+        raise IncompleteResponseError(f"Could not parse the model's response: {(content or '')[:200]}") from e
+
+    results = [None] * count
+    for item in items:
+        try:
+            idx = int(item["id"]) - 1
+            verdict, explanation = item["verdict"], item["explanation"]
+        except (KeyError, TypeError, ValueError):
+            continue
+
+        if 0 <= idx < count and verdict in ("Contradiction", "Neutral"):
+            results[idx] = f"{verdict}: {str(explanation).strip()}"
+
+    missing = [idx + 1 for idx, result in enumerate(results) if result is None]
+    if missing:
+        raise IncompleteResponseError(f"No verdict for sentences {missing} in the model's response.")
+
+    return results
+
+
+@retry(
+    stop=stop_after_attempt(5),
+    wait=wait_exponential(multiplier=1, max=30),
+    retry=retry_if_exception_type(
+        (RateLimitError, InternalServerError, APIConnectionError, IncompleteResponseError)),
+    reraise=True
+)
+async def check_contradiction(sentences, arbitration_document):
+    """
+    Compares a group of sentences (typically from witness statements) against a page from an arbitration document
+    to detect any contradictions or inconsistencies using Azure OpenAI's GPT-4o model, in a single request.
+
+    Rate limit (429), server (5xx) and connection errors, as well as incomplete responses, are retried with
+    exponential backoff. Incomplete responses are removed from the response cache, so the retry asks the model again.
+
+    Parameters:
+        sentences (list): The sentences from witness statements to evaluate.
+        arbitration_document (str): The full page of the arbitration document to compare against.
+
+    Returns:
+        list: One result message per sentence indicating whether there is a contradiction ("Contradiction:")
+              or not ("Neutral:"), followed by a concise explanation.
+
+    Raises:
+        IncompleteResponseError: If the model still didn't answer every sentence after the retries.
+    """
+    request = {
+        "model": "gpt-4o",
+        "messages": build_messages(sentences, arbitration_document),
+        "response_format": RESPONSE_FORMAT,
+        "max_tokens": max_tokens_for(sentences)
+    }
+
+    response = await chat_completion(**request)
+    choice = response.choices[0]
+
+    try:
+        return parse_results(choice.message.content, len(sentences), choice.finish_reason)
+    except IncompleteResponseError:
+        get_default_cache().delete(make_key(**request))
+        raise
+
+
+async def check_contradictions_batch(groups, poll_interval=60):
+    """
+    Runs the contradiction checks for many (sentences, arbitration_document) groups as a single
+    Azure OpenAI Batch API job, which is processed server-side at a discounted token price.
+
+    Parameters:
+        groups (list): List of (sentences, arbitration_document) tuples.
+        poll_interval (int): Seconds to wait between batch status checks.
+
+    Returns:
+        list: One list of result messages per group, in the same order as `groups`. Groups whose request
+              failed inside the batch or returned an incomplete response get None.
+    """
+    # Writing one chat completion request per group
+    request_lines = [
+        json.dumps({
+            "custom_id": str(idx),
+            "method": "POST",
+            "url": "/chat/completions",
+            "body": {
+                "model": "gpt-4o",
+                "messages": build_messages(sentences, arbitration_document),
+                "response_format": RESPONSE_FORMAT,
+                "max_tokens": max_tokens_for(sentences)
+            }
+        }, ensure_ascii=False)
+        for idx, (sentences, arbitration_document) in enumerate(groups)
+    ]
+
+    batch_input = await client.files.create(
+        file=("contradiction_checks.jsonl",
+              "\n".join(request_lines).encode("utf-8")),
+        purpose="batch"
+    )
+    batch = await client.batches.create(
+        input_file_id=batch_input.id,
+        endpoint="/chat/completions",
+        completion_window="24h"
     )
+    print(f"Submitted batch {batch.id} with {len(request_lines)} requests.")
+
+    # Polling until the batch is done
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        await asyncio.sleep(poll_interval)
+        batch = await client.batches.retrieve(batch.id)
+        print(f"Batch {batch.id}: {batch.status}")
+
+    if batch.status != "completed":
+        raise RuntimeError(
+            f"Batch {batch.id} ended with status '{batch.status}'.")
+
+    # Reassembling the results by custom_id
+    results = [None] * len(groups)
+    output = await client.files.content(batch.output_file_id)
+
+    for line in output.text.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        response = record.get("response") or {}
 
-    return response.choices[0].message.content.strip()
+        if response.get("status_code") != 200:
+            print(
+                f"Request {record['custom_id']} failed: {record.get('error') or response}")
+            continue
 
+        idx = int(record["custom_id"])
+        choice = response["body"]["choices"][0]
+        try:
+            results[idx] = parse_results(
+                choice["message"]["content"], len(groups[idx][0]), choice.get("finish_reason"))
+        except IncompleteResponseError as e:
+            print(f"Request {record['custom_id']} returned an incomplete response: {e}")
+
+    return results
+
+
+async def embed_texts(texts, batch_size=256):
+    """
+    Embeds texts with Azure OpenAI's embedding model, sending the batches concurrently.
+
+    Parameters:
+        texts (list): List of strings to embed.
+        batch_size (int): Number of texts per embeddings request.
 
-def detect_witness_contradictions(document_pages, witness_statements, excluded_sections, output_path):
+    Returns:
+        np.ndarray: L2-normalized embeddings, one row per text.
+    """
+    batches = [[(text or " ")[:MAX_EMBEDDING_CHARS] for text in texts[start:start + batch_size]]
+               for start in range(0, len(texts), batch_size)]
+
+    responses = await asyncio.gather(
+        *(client.embeddings.create(model=EMBEDDING_MODEL, input=batch) for batch in batches))
+
+    vectors = np.array([item.embedding for response in responses for item in response.data],
+                       dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+async def select_candidate_pairs(witness_texts, doc_texts, top_k, doc_vectors=None):
+    """
+    Pre-screens the witness/document grid by cosine similarity, so that only the document pages most
+    related to a witness statement are sent to GPT-4o.
+
+    Parameters:
+        witness_texts (list): Texts of the witness statements.
+        doc_texts (list): Texts of the document pages.
+        top_k (int): Number of most similar document pages to keep per witness statement.
+        doc_vectors (np.ndarray, optional): Precomputed normalized embeddings of `doc_texts`.
+
+    Returns:
+        list: (witness index, document index) pairs to check.
+    """
+    if not witness_texts or not doc_texts:
+        return []
+
+    if top_k >= len(doc_texts):
+        return [(w_idx, d_idx) for w_idx in range(len(witness_texts)) for d_idx in range(len(doc_texts))]
+
+    # Embedding everything in one go (unless the document index is given) and scoring all pairs at once
+    if doc_vectors is None:
+        vectors = await embed_texts(witness_texts + doc_texts)
+        witness_vectors, doc_vectors = vectors[:len(witness_texts)], vectors[len(witness_texts):]
+    else:
+        witness_vectors = await embed_texts(witness_texts)
+
+    similarities = witness_vectors @ doc_vectors.T
+
+    top_docs = np.argpartition(-similarities, top_k - 1, axis=1)[:, :top_k]
+
+    return [(w_idx, int(d_idx)) for w_idx, row in enumerate(top_docs) for d_idx in np.sort(row)]
+
+
+def load_checkpoint(checkpoint_path):
+    """Returns {(w_idx, d_idx): result_entry} for the pairs already saved in the JSONL checkpoint"""
+    return {(record["w_idx"], record["d_idx"]): record for record in read_jsonl(checkpoint_path)}
+
+
+async def detect_witness_contradictions(document_pages, witness_statements, excluded_sections, output_path,
+                                        max_concurrency=16, use_batch_api=False, top_k=10, sentences_per_call=8,
+                                        doc_index=None):
     """
     Detects contradictions between witness statements and document pages.
 
     This function compares filtered witness statements to selected pages from arbitration documents,
-    excluding specified sections. It uses the `check_contradiction` function to identify contradictions,
+    excluding specified sections. Each witness statement is only compared to the `top_k` document pages
+    closest to it in embedding space. Witness statements compared to the same page are sent together, up to
+    `sentences_per_call` per request. It uses the `check_contradiction` function to identify contradictions,
+    sending up to `max_concurrency` requests at a time (or a single Batch API job if `use_batch_api` is set),
     then saves the results in a JSON file.
 
+    Every checked pair is appended to a JSONL checkpoint next to the output file (`output_path + ".jsonl"`) as soon
+    as its request completes, so an interrupted run picks up where it stopped. Pairs whose responses stayed
+    incomplete are left out of the checkpoint and the output. The checkpoint is removed once every pair is written
+    to the JSON file.
+
     Parameters:
         document_pages: List of dictionaries representing pages of the arbitration document.
         witness_statements: List of dictionaries representing witness statements.
         excluded_sections: Set of section names to exclude from comparison.
         output_path: File path to save the output JSON containing contradiction results.
+        max_concurrency: Maximum number of requests in flight.
+        use_batch_api: Whether to submit the checks through the Azure OpenAI Batch API instead.
+        top_k: Number of most similar document pages to check per witness statement (None checks all pages).
+        sentences_per_call: Maximum number of witness statements checked against a page in one request.
+        doc_index: Embeddings of `document_pages` from `load_doc_index` (the pages are embedded on the fly if None).
 
     Returns:
         None. Outputs a JSON file at the specified path.
     """
 
-    # Filtering out excluded document sections
-    filtered_docs = [entry for entry in document_pages
-                     if entry.get("section") not in excluded_sections and entry.get("section") is not None]
+    # Filtering out excluded document sections, keeping the pages' rows in the document index
+    doc_rows = [row for row, entry in enumerate(document_pages)
+                if (section := entry.get("section")) is not None and section not in excluded_sections]
+    filtered_docs = [document_pages[row] for row in doc_rows]
 
     # Filtering out nonsensical witness statements
     witness_statements_f = [
         entry for entry in witness_statements if entry.get("nonsense", 0) < 5]
 
-    # Storing results
-    contradictions = []
-
-    for witness_chunk in witness_statements_f:
-        witness_text = witness_chunk.get("text")
-
-        for entry in filtered_docs:
-            doc_text = entry.get("text")
-            response = check_contradiction(witness_text, doc_text)
-
-            result_entry = {
-                "witness_statement": witness_text,
-                "witness_page": witness_chunk.get("page"),
-                "witness_section": witness_chunk.get("section"),
-                "doc_text": doc_text,
-                "doc_page": entry.get("page"),
-                "doc_section": entry.get("section"),
-                "result": response
-            }
-
-            if "type" in witness_chunk:
-                result_entry["w_s_type"] = witness_chunk["type"]
-            if "type" in entry:
-                result_entry["doc_type"] = entry["type"]
-
-            contradictions.append(result_entry)
-
-    # Saving results to JSON
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(contradictions, f, indent=4, ensure_ascii=False)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    # Keeping the most similar document pages for each witness statement
+    witness_texts = [witness_chunk.get("text") for witness_chunk in witness_statements_f]
+    doc_texts = [entry.get("text") for entry in filtered_docs]
+
+    candidate_pairs = await select_candidate_pairs(
+        witness_texts, doc_texts, len(doc_texts) if top_k is None else top_k,
+        doc_vectors=None if doc_index is None else doc_index[doc_rows])
+    print(f"Checking {len(candidate_pairs)} of {len(witness_texts) * len(doc_texts)} witness/document pairs.")
+
+    # Skipping the pairs already checked by a previous run
+    checkpoint_path = output_path + ".jsonl"
+    done = load_checkpoint(checkpoint_path)
+    remaining_pairs = [pair for pair in candidate_pairs if pair not in done]
+    print(f"{len(candidate_pairs) - len(remaining_pairs)} pairs restored from {checkpoint_path}.")
+
+    # Sending each distinct (witness text, document text) pair only once
+    unique_pairs = {}
+    positions = {}
+
+    for w_idx, d_idx in remaining_pairs:
+        witness_text, doc_text = witness_texts[w_idx] or "", doc_texts[d_idx] or ""
+        key = hashlib.blake2b(f"{witness_text}\x00{doc_text}".encode("utf-8"), digest_size=16).digest()
+        unique_pairs.setdefault(key, (witness_text, doc_text))
+        positions.setdefault(key, []).append((w_idx, d_idx))
+
+    # Grouping the witness statements compared to the same page
+    keys_by_doc = {}
+    for key, (_, doc_text) in unique_pairs.items():
+        keys_by_doc.setdefault(doc_text, []).append(key)
+
+    group_keys = []
+    groups = []
+    for doc_text, keys in keys_by_doc.items():
+        for start in range(0, len(keys), sentences_per_call):
+            chunk_keys = keys[start:start + sentences_per_call]
+            group_keys.append(chunk_keys)
+            groups.append(([unique_pairs[key][0] for key in chunk_keys], doc_text))
+
+    print(f"{len(unique_pairs)} distinct pairs to check in {len(groups)} requests.")
+
+    with open(checkpoint_path, "ab") as checkpoint:
+
+        def save_responses(chunk_keys, responses):
+            """Fans the responses of a request back out to every pair and appends them to the checkpoint"""
+            for key, response in zip(chunk_keys, responses):
+                for w_idx, d_idx in positions[key]:
+                    witness_chunk, entry = witness_statements_f[w_idx], filtered_docs[d_idx]
+                    result_entry = {
+                        "witness_statement": witness_chunk.get("text"),
+                        "witness_page": witness_chunk.get("page"),
+                        "witness_section": witness_chunk.get("section"),
+                        "doc_text": entry.get("text"),
+                        "doc_page": entry.get("page"),
+                        "doc_section": entry.get("section"),
+                        "result": response
+                    }
+
+                    if "type" in witness_chunk:
+                        result_entry["w_s_type"] = witness_chunk["type"]
+                    if "type" in entry:
+                        result_entry["doc_type"] = entry["type"]
+
+                    done[(w_idx, d_idx)] = result_entry
+                    checkpoint.write(orjson.dumps(
+                        {**result_entry, "w_idx": w_idx, "d_idx": d_idx}) + b"\n")
+
+            checkpoint.flush()
+
+        async def bounded_check(chunk_keys, sentences, doc_text):
+            async with semaphore:
+                try:
+                    responses = await check_contradiction(sentences, doc_text)
+                except IncompleteResponseError as e:
+                    # Leaving the pairs out of the checkpoint, so the next run checks them again
+                    print(f"Skipping {len(sentences)} sentences after repeated incomplete responses: {e}")
+                    return
+            save_responses(chunk_keys, responses)
+
+        if use_batch_api:
+            if groups:
+                group_responses = await check_contradictions_batch(groups)
+                for chunk_keys, responses in zip(group_keys, group_responses):
+                    if responses is not None:
+                        save_responses(chunk_keys, responses)
+        else:
+            await asyncio.gather(
+                *(bounded_check(chunk_keys, sentences, doc_text)
+                  for chunk_keys, (sentences, doc_text) in zip(group_keys, groups)))
+
+    # Storing results in candidate order, writing each entry to the JSON file as it's read
+    missing = 0
+    with JsonArrayWriter(output_path) as writer:
+        for pair in candidate_pairs:
+            if pair not in done:
+                missing += 1
+                continue
+            result_entry = {key: value for key, value in done[pair].items()
+                            if key not in ("w_idx", "d_idx")}
+            writer.write(result_entry)
+
+    # Keeping the checkpoint while some pairs are unchecked, so a re-run only sends those
+    if missing:
+        print(f"{missing} pairs couldn't be checked, re-run the script to retry them.")
+    else:
+        os.remove(checkpoint_path)
 
     print(f"Witness contradictions JSON file created at: {output_path}")
 
 
 # Loading the input data
-with open("../results/combined_doc_sections_with_tables.json", "r", encoding="utf-8") as f:
-    document_pages = json.load(f)
+with open("../results/combined_doc_sections_with_tables.json", "rb") as f:
+    document_pages = orjson.loads(f.read())
+
+with open("../results/w_s_with_tables.json", "rb") as f:
+    witness_statements = orjson.loads(f.read())
 
-with open("../results/w_s_with_tables.json", "r", encoding="utf-8") as f:
-    witness_statements = json.load(f)
+# Loading the document embedding index (None if it wasn't built for these pages)
+doc_index = load_doc_index(document_pages)
 
 # Defining the sections to exclude
-excluded_sections = {
+excluded_sections = frozenset({
     "Claimant Exhibit C 5", "Claimant Exhibit C 8",
     "Respondent Exhibit R 1", "Respondent Exhibit R 2",
     "Respondent Exhibit R 3", "Respondent Exhibit R 4",
     "Procedural Order No. 1"
-}
+})
 
 # Setting output file path
 # output_file = "../results/comp_results1.json"
 output_file = "../results/comp_results2.json"
 
+# Submitting the checks as one Batch API job (cheaper, but results can take up to 24h)
+use_batch_api = False
+
+# Number of most similar document pages to check per witness statement
+top_k = 10
+
 # Running the contradiction detection
-detect_witness_contradictions(
-    document_pages, witness_statements, excluded_sections, output_file)
+asyncio.run(detect_witness_contradictions(
+    document_pages, witness_statements, excluded_sections, output_file,
+    use_batch_api=use_batch_api, top_k=top_k, doc_index=doc_index))
@@ -1,9 +1,12 @@
 """
 This script processes a PDF file containing a Witness Statement by:
 1. Extracting tables using Google Gemini API and summarizing them using Azure OpenAI GPT-4o.
-2. Extracting text using Google Document AI and structuring it into sentence-level JSON using GPT-4o.
+2. Extracting text using Google Document AI and structuring it into sentence-level JSON using GPT-4o mini.
 3. Combining both outputs and saving them into a JSON file.
 
+The table and text pipelines run concurrently on the same PDF bytes, and the OpenAI requests (each covering a
+few tables or pages) are sent concurrently, at most 8 at a time.
+
 Environment Variables:
 - PROJECT_ID: GCP project ID
 - PROCESSOR_ID: Document AI processor ID
@@ -15,20 +18,31 @@ Environment Variables:
 Dependencies:
 - google-cloud-documentai
 - google-generativeai
-- openai
-- pathlib, json, os, re
+- openai, httpx
+- orjson
+- tenacity
+- gemini_tables (local module, parses the tables extracted by Gemini)
+- cache (local module, caches the model responses between runs)
+- json_stream (local module, writes the output JSON incrementally)
+- pathlib, os, asyncio, functools, hashlib
 """
 
 from google.api_core.client_options import ClientOptions
 from google.cloud import documentai_v1
 import os
-from openai import AzureOpenAI
-import json
-import re
+from openai import AsyncAzureOpenAI, DefaultAsyncHttpxClient
+import httpx
+import orjson
 from google import genai
-from google.genai import types
+from google.genai import errors, types
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 import pathlib
-import os
+import asyncio
+import functools
+import hashlib
+from cache import cached_chat, get_default_cache, make_key
+from json_stream import JsonArrayWriter
+from gemini_tables import MalformedTablesError, parse_tables_json
 
 project_id = os.getenv("PROJECT_ID")
 processor_id = os.getenv("PROCESSOR_ID")
@@ -36,42 +50,24 @@ location = os.getenv("LOCATION")
 location_gemini = os.getenv("LOCATION_GEMINI")
 file_path = "../data/32nd-Vis-Moot_Problem_incl_PO2/07 - Claimant Exhibit C 5.pdf"
 
-client_openai = AzureOpenAI(
+# Reading the PDF and its section name once for both pipelines
+PDF_BYTES = pathlib.Path(file_path).read_bytes()
+SECTION_NAME = pathlib.Path(file_path).stem.split(" - ", 1)[-1].strip()
+
+# Keeping enough warm connections for all concurrent requests
+client_openai = AsyncAzureOpenAI(
     api_key=os.getenv("AZURE_OPENAI_API_KEY"),
     api_version="2024-02-01",
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
+    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+    http_client=DefaultAsyncHttpxClient(
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=32))
 )
 
-# Extracting Tables
-
-
-def extract_tables_and_summarize_w_s(file_path, project_id, location_gemini):
-    """
-    Extracts tables from the given PDF file using Gemini and summarizes them
-    into descriptive sentences using Azure OpenAI GPT-4o.
-
-    Args:
-        file_path (str): Path to the PDF file.
-        project_id (str): GCP project ID.
-        location_gemini (str): Location of Gemini model.
-
-    Returns:
-        list: A list of JSON dictionaries containing structured sentences per table.
-    """
-    # Setting up Google GenAI client
-    client_genai = genai.Client(
-        vertexai=True,
-        project=project_id,
-        location=location_gemini
-    )
+# Completion budget of one page broken into sentences
+MAX_TOKENS_PER_PAGE = 2048
 
-    # Reading the PDF
-    pdf_file = pathlib.Path(file_path)
-    section_name = pdf_file.stem.split(" - ", 1)[-1].strip()
-    response = client_genai.models.generate_content(
-        model="gemini-2.5-flash-preview-04-17",
-        contents=[
-            """Extract only the tables from the attached PDF and return the result in **valid JSON format**.
+# Prompt for extracting the tables of the PDF with Gemini
+TABLE_EXTRACTION_PROMPT = """Extract only the tables from the attached PDF and return the result in **valid JSON format**.
 
             Group all tables by their page number. For each entry in the json, use the following structure:
 
@@ -81,187 +77,334 @@ def extract_tables_and_summarize_w_s(file_path, project_id, location_gemini):
             }
 
             If you see any subcategories or subheaders include those.
-            Do not include any text or commentary outside the JSON structure. Only return JSON.""",
-            types.Part.from_bytes(data=pdf_file.read_bytes(),
-                                  mime_type="application/pdf"),
-        ],
-    )
+            Do not include any text or commentary outside the JSON structure. Only return JSON."""
 
-    # Extracting JSON block from the GenAI response
-    match = re.search(r"```json\s*(.*?)\s*```", response.text, re.DOTALL)
-    if not match:
-        raise ValueError("Could not extract JSON from GenAI response.")
+# System prompt for turning tables into sentences, formatted once per document with its section name
+TABLE_SYSTEM_PROMPT = """
+You are a helpful assistant that turns tables into structured paragraph sentences in JSON format.
 
-    tables_data = json.loads(match.group(1))
-
-    # Processing tables into descriptive sentences
-    all_sentences = []
-    for table in tables_data:
-        prompt = f"""
 You are given a list of extracted tables from a document. Each entry includes the table data and the page number.
 
-Analyze the table and convert the data into a series of clear, descriptive sentences that can also be clearly understood taken by itself, make sure to include all the row, column, subrow, subcolumn names in them. For each sentence, include:
+Analyze each table and convert the data into a series of clear, descriptive sentences that can also be clearly understood taken by itself, make sure to include all the row, column, subrow, subcolumn names in them. Cover every table in the list. For each sentence, include:
 - "text": the sentence itself (don't include a page number in the sentence),
 - "page": the page number it comes from.
 
-Your response should be a valid JSON array of dictionaries in this format:
-[
-  {{
-    "section": Witness Statement ({section_name})
-    "text": "...",
-    "page": {table["page"]},
-    "type": "table",
-    "nonsense": A nonsense score from 0 to 10 (10 as a sentence that doesn't contain a fact or a useful statement and 0 as a sentence that contains very useful information), give a higher score to incomplete sentences.
-  }},
-  ...
-]
+Your response should be a valid JSON object holding the list of sentences under "items", in this format:
+{{
+  "items": [
+    {{
+      "section": Witness Statement ({section_name})
+      "text": "...",
+      "page": <the page number of the table the sentence comes from>,
+      "type": "table",
+      "nonsense": A nonsense score from 0 to 10 (10 as a sentence that doesn't contain a fact or a useful statement and 0 as a sentence that contains very useful information), give a higher score to incomplete sentences.
+    }},
+    ...
+  ]
+}}
 
 Only output valid JSON. Do not include any extra explanation or commentary.
+"""
+
+# System prompt for breaking pages into sentences, formatted once per document with its section name
+SENTENCE_SYSTEM_PROMPT = """
+You are a helpful assistant that converts legal text into structured JSON, focusing on clarity and completeness.
 
-Here is the input data:
-{json.dumps([table], indent=2)}
+Break down the text you are given sentence by sentence into a structured JSON format. Each sentence should include:
+1. Section title "Witness Statement ({section_name})" under "section".
+2. The number of the page the sentence comes from under "page" (each page of the text starts with a "Page <number>:" line).
+3. Sentence text under "text" (ignore footers).
+4. A nonsense score from 0 to 10 (10 as a sentence that doesn't contain a fact or a useful statement and 0 as a sentence that contains very useful information) under "nonsense", give a higher score to incomplete sentences (sentences with no ending or no beginning).
+Exclude things you think may be a table text.
+
+Return a JSON object with the list of sentences under "items": {{"items": [{{"section": ..., "page": ..., "text": ..., "nonsense": ...}}, ...]}}
 """
-        response = client_openai.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that turns tables into structured paragraph sentences in JSON format."},
-                {"role": "user", "content": prompt}
+
+# Re-running on the same PDF reuses the stored responses instead of calling the APIs again
+chat_completion = cached_chat(client_openai)
+
+
+@functools.lru_cache(maxsize=None)
+def get_genai_client(project_id, location_gemini):
+    """Returns the shared Google GenAI client for a project and location."""
+    return genai.Client(
+        vertexai=True,
+        project=project_id,
+        location=location_gemini
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_doc_ai_client(location):
+    """
+    Returns the shared Document AI client for a location. It is created on first use, so that
+    it belongs to the running event loop.
+    """
+    opts = ClientOptions(api_endpoint=f"{location}-documentai.googleapis.com")
+    return documentai_v1.DocumentProcessorServiceAsyncClient(client_options=opts)
+
+
+def batched(items, size):
+    """Splits a list into consecutive lists of at most `size` items."""
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def parse_items(response):
+    """
+    Returns the "items" list of a JSON mode chat completion.
+
+    Raises ValueError (or KeyError/TypeError for an unexpected structure) if the response was cut off by the
+    token limit or isn't valid JSON.
+    """
+    choice = response.choices[0]
+    if choice.finish_reason == "length":
+        raise ValueError("Response cut off by the token limit.")
+    return orjson.loads(choice.message.content)["items"]
+
+
+# Extracting Tables
+
+
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=1, max=10),
+    retry=retry_if_exception_type((errors.APIError, MalformedTablesError)),
+    reraise=True
+)
+async def extract_tables_with_gemini(client_genai, pdf_bytes):
+    """
+    Extracts the tables from the PDF using Gemini in JSON mode, unless the same request was answered before.
+    The call is retried with exponential backoff on API errors and on JSON that isn't a list of page entries.
+
+    Args:
+        client_genai (genai.Client): The Google GenAI client.
+        pdf_bytes (bytes): Content of the PDF file.
+
+    Returns:
+        list: A list of {"page": ..., "tables": ...} dictionaries.
+    """
+    model = "gemini-2.5-flash-preview-04-17"
+
+    cache = get_default_cache()
+    key = make_key(model=model, prompt=TABLE_EXTRACTION_PROMPT, response_mime_type="application/json",
+                   pdf=hashlib.blake2b(pdf_bytes).hexdigest())
+    response_text = cache.get(key)
+    if response_text is None:
+        response = await client_genai.aio.models.generate_content(
+            model=model,
+            contents=[
+                TABLE_EXTRACTION_PROMPT,
+                types.Part.from_bytes(data=pdf_bytes,
+                                      mime_type="application/pdf"),
             ],
-            temperature=0.3
+            config=types.GenerateContentConfig(response_mime_type="application/json"),
         )
+        response_text = response.text
+
+    try:
+        tables = parse_tables_json(response_text)
+    except MalformedTablesError:
+        # Dropping a stored response that doesn't parse, so the retry asks Gemini again
+        cache.delete(key)
+        raise
+
+    # Storing the response only once it parses
+    cache.set(key, response_text)
+    return tables
+
+
+async def extract_tables_and_summarize_w_s(pdf_bytes, section_name, project_id, location_gemini, semaphore,
+                                           tables_per_call=5):
+    """
+    Extracts tables from the given PDF file using Gemini and summarizes them
+    into descriptive sentences using Azure OpenAI GPT-4o, one concurrent request per `tables_per_call` tables.
+
+    Args:
+        pdf_bytes (bytes): Content of the PDF file.
+        section_name (str): Name of the witness statement, used in the "section" field.
+        project_id (str): GCP project ID.
+        location_gemini (str): Location of Gemini model.
+        semaphore (asyncio.Semaphore): Limits the number of GPT-4o requests in flight.
+        tables_per_call (int): Number of tables summarized in one GPT-4o request.
+
+    Returns:
+        list: A list of JSON dictionaries containing structured sentences per table.
+    """
+    # Getting the shared Google GenAI client
+    client_genai = get_genai_client(project_id, location_gemini)
+
+    # Extracting the tables from the PDF, without failing the text pipeline if Gemini's answer stays unusable
+    try:
+        tables_data = await extract_tables_with_gemini(client_genai, pdf_bytes)
+    except MalformedTablesError as e:
+        print(f"Skipping the tables after repeated malformed responses: {e}")
+        return []
+
+    # Dropping pages Gemini returned without any table content
+    tables_data = [entry for entry in tables_data if entry.get("tables")]
+    if not tables_data:
+        return []
+
+    # Instructions shared by every table of the document, sent as an identical prefix
+    system_prompt = TABLE_SYSTEM_PROMPT.format(section_name=section_name)
+
+    # Processing tables into descriptive sentences, a few tables per request
+    async def summarize_tables(tables):
+        request = {
+            "model": "gpt-4o",
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"Here is the input data:\n{orjson.dumps(tables, option=orjson.OPT_INDENT_2).decode()}"}
+            ],
+            "temperature": 0.3,
+            "response_format": {"type": "json_object"}
+        }
+        async with semaphore:
+            response = await chat_completion(**request)
 
-        content = response.choices[0].message.content.strip()
         try:
-            result = json.loads(content)
-            all_sentences.extend(result)
-        except json.JSONDecodeError:
+            return parse_items(response)
+        except (ValueError, KeyError, TypeError):
+            # Dropping the response from the cache, so a re-run asks the model again
+            get_default_cache().delete(make_key(**request))
+            pages = ", ".join(str(table.get("page")) for table in tables)
             print(
-                f"Failed to parse JSON from table on page {table.get('page')}. Skipping...")
-            print(content)
-
-    return all_sentences
+                f"Failed to parse JSON from tables on pages {pages}. Skipping...")
+            print(response.choices[0].message.content)
+            return []
 
+    table_results = await asyncio.gather(
+        *(summarize_tables(tables) for tables in batched(tables_data, tables_per_call)))
+    all_sentences = [sentence for result in table_results for sentence in result]
 
-result_tables = extract_tables_and_summarize_w_s(
-    file_path, project_id, location_gemini)
+    return all_sentences
 
 
 # Extracting Text
 
-def extract_sentences_from_w_s(file_path, project_id, location, processor_id):
+async def extract_sentences_from_w_s(pdf_bytes, section_name, project_id, location, processor_id, semaphore,
+                                     pages_per_call=3):
     """
     Extracts textual sentences from the PDF using Google Document AI and formats them
-    as structured JSON entries via GPT-4o, including section and nonsense score.
+    as structured JSON entries via GPT-4o mini (one concurrent request per `pages_per_call` pages), including section
+    and nonsense score.
 
     Args:
-        file_path (str): Path to the PDF file.
+        pdf_bytes (bytes): Content of the PDF file.
+        section_name (str): Name of the witness statement, used in the "section" field.
         project_id (str): GCP project ID.
         location (str): GCP location for Document AI.
         processor_id (str): Processor ID for Document AI.
+        semaphore (asyncio.Semaphore): Limits the number of OpenAI requests in flight.
+        pages_per_call (int): Number of pages broken down in one GPT-4o mini request.
 
     Returns:
         list: A list of dictionaries with extracted structured text per sentence.
     """
-    # Initializing Document AI client
-    opts = ClientOptions(api_endpoint=f"{location}-documentai.googleapis.com")
-    client_doc_ai = documentai_v1.DocumentProcessorServiceClient(
-        client_options=opts)
+    # Getting the shared Document AI client
+    client_doc_ai = get_doc_ai_client(location)
     full_processor_name = client_doc_ai.processor_path(
         project_id, location, processor_id)
 
-    # Getting processor
-    request = documentai_v1.GetProcessorRequest(name=full_processor_name)
-    processor = client_doc_ai.get_processor(request=request)
-
-    # Reading and processing file
-    with open(file_path, "rb") as image:
-        image_content = image.read()
-
+    # Processing file (the processor path is sent directly, without looking the processor up first)
     raw_document = documentai_v1.RawDocument(
-        content=image_content, mime_type="application/pdf",)
+        content=pdf_bytes, mime_type="application/pdf",)
     request = documentai_v1.ProcessRequest(
-        name=processor.name, raw_document=raw_document)
-    result = client_doc_ai.process_document(request=request)
+        name=full_processor_name, raw_document=raw_document)
+    result = await client_doc_ai.process_document(request=request)
     document = result.document
     text = document.text
 
     # Extracting page-wise text
     page_texts = []
     for page in document.pages:
-        page_text = ""
-        for segment in page.layout.text_anchor.text_segments:
-            start = int(segment.start_index) if segment.start_index else 0
-            end = int(segment.end_index)
-            page_text += text[start:end]
+        # Joining the page's text segments in one pass instead of repeated string concatenation
+        page_text = "".join(
+            text[int(segment.start_index or 0):int(segment.end_index)]
+            for segment in page.layout.text_anchor.text_segments
+        )
         page_texts.append(page_text.strip())
 
     # Function to add overlaps
     def add_overlaps(chunks, overlap_words=15):
-        overlapped_chunks = []
-        for i in range(len(chunks)):
-            current_chunk = chunks[i]
-            current_words = current_chunk.split()
-            if i > 0:
-                prev_words = chunks[i - 1].split()
-                overlap = prev_words[-overlap_words:] if len(
-                    prev_words) >= overlap_words else prev_words
-                current_chunk = " ".join(overlap) + \
-                    " " + " ".join(current_words)
-            overlapped_chunks.append(current_chunk)
+        # Splitting every chunk into words once
+        chunk_words = [chunk.split() for chunk in chunks]
+
+        overlapped_chunks = chunks[:1]
+        for prev_words, current_words in zip(chunk_words, chunk_words[1:]):
+            overlapped_chunks.append(
+                " ".join(prev_words[-overlap_words:] + current_words))
         return overlapped_chunks
 
     overlapped_chunks = add_overlaps(page_texts, overlap_words=45)
 
-    all_results = []
-    pdf_file = pathlib.Path(file_path)
-    section_name = pdf_file.stem.split(" - ", 1)[-1].strip()
-
-    # Processing each chunk
-    for i, chunk in enumerate(overlapped_chunks):
-        page_number = i + 1
-        prompt = f"""
-Break down the following text sentence by sentence into a structured JSON format. Each sentence should include:
-1. Section title "Witness Statement ({section_name})" under "section".
-2. {page_number} under "page".
-3. Sentence text under "text" (ignore footers).
-4. A nonsense score from 0 to 10 (10 as a sentence that doesn't contain a fact or a useful statement and 0 as a sentence that contains very useful information) under "nonsense", give a higher score to incomplete sentences (sentences with no ending or no beginning).
-Exclude things you think may be a table text.
+    # Instructions shared by every page of the document, sent as an identical prefix
+    system_prompt = SENTENCE_SYSTEM_PROMPT.format(section_name=section_name)
 
-Here is the text to analyze:
+    # Processing the chunks, a few pages per request
+    async def process_chunks(numbered_chunks):
+        pages_text = "\n\n".join(
+            f"Page {page_number}:\n{chunk}" for page_number, chunk in numbered_chunks)
+        page_numbers = ", ".join(str(page_number) for page_number, _ in numbered_chunks)
 
-{chunk}
-"""
-        response = client_openai.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that converts legal text into structured JSON, focusing on clarity and completeness."},
-                {"role": "user", "content": prompt}
-            ]
-        )
+        request = {
+            "model": "gpt-4o-mini",
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"Here is the text to analyze:\n\n{pages_text}"}
+            ],
+            "temperature": 0,
+            "seed": 42,
+            "max_tokens": MAX_TOKENS_PER_PAGE * len(numbered_chunks),
+            "response_format": {"type": "json_object"}
+        }
+        async with semaphore:
+            response = await chat_completion(**request)
 
-        result_text = response.choices[0].message.content.strip()
-        match = re.search(r"```json\s*(.*?)\s*```", result_text, re.DOTALL)
-        if match:
-            json_str = match.group(1)
-            try:
-                parsed = json.loads(json_str)
-                all_results.extend(parsed)
-            except json.JSONDecodeError as e:
-                print(f"JSON parsing failed on page {page_number}: {e}")
-                print(json_str)
-        else:
-            raise ValueError("Could not extract JSON from GenAI response.")
+        try:
+            return parse_items(response)
+        except (ValueError, KeyError, TypeError) as e:
+            # Dropping the response from the cache, so a re-run asks the model again
+            get_default_cache().delete(make_key(**request))
+            print(f"JSON parsing failed on pages {page_numbers}: {e}")
+            print(response.choices[0].message.content)
+            return []
+
+    # Skipping pages without any text (the overlap alone would only repeat the previous page)
+    numbered_chunks = [
+        (page_number, chunk)
+        for page_number, (chunk, page_text) in enumerate(zip(overlapped_chunks, page_texts), start=1)
+        if page_text
+    ]
+    chunk_results = await asyncio.gather(
+        *(process_chunks(batch) for batch in batched(numbered_chunks, pages_per_call)))
+    all_results = [sentence for result in chunk_results for sentence in result]
 
     return all_results
 
 
-result_text = extract_sentences_from_w_s(
-    file_path, project_id, location, processor_id)
+async def main(output_path):
+    """Runs the table and text extraction and writes the combined sentences to `output_path`."""
+    # Sharing one request limit between both stages
+    semaphore = asyncio.Semaphore(8)
+
+    # Running the table and text extraction concurrently
+    result_tables, result_text = await asyncio.gather(
+        extract_tables_and_summarize_w_s(
+            PDF_BYTES, SECTION_NAME, project_id, location_gemini, semaphore),
+        extract_sentences_from_w_s(
+            PDF_BYTES, SECTION_NAME, project_id, location, processor_id, semaphore)
+    )
+
+    # Storing text and tables from the Witness Statement in a JSON, one sentence at a time
+    with JsonArrayWriter(output_path) as writer:
+        for sentence in result_text:
+            writer.write(sentence)
+        for sentence in result_tables:
+            writer.write(sentence)
+
+    print(f"{writer.count} sentences saved to {output_path}")
 
-# Combining text and tables from the Witness Statement
-result_w_s = result_text + result_tables
 
-# Storing in a JSON
 output_path = "../results/w_s_with_tables.json"
-with open(output_path, "w", encoding="utf-8") as f:
-    json.dump(result_w_s, f, indent=4, ensure_ascii=False)
+asyncio.run(main(output_path))